@@ -1,20 +1,32 @@
 # app/main.py (updated version)
 import time
 import os
+import json
+import asyncio
+import math
+import secrets
 import traceback
 from fastapi import FastAPI, HTTPException, status, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 
 from app.models import MessageRequest, MessageResponse
+from app.services.chat_pipeline import ChatPipeline, ClientDisconnected, FALLBACK_MESSAGE, TIMEOUT_MESSAGE
 from app.services.chat_service import ChatService
 from app.services.detection_service import DetectionService
-from app.utils.helpers import detect_language
-from app.utils.logger import logger
-from app.utils.rate_limiter import RateLimiter
+from app.services.session_store import create_session_store
+from app.utils.bulkhead import Bulkhead, BulkheadFull
+from app.utils.helpers import preload_language_profiles
+from app.utils.log_context import stage
+from app.utils.logger import log_stats, logger
+from app.utils.metrics import registry as metrics_registry
+from app.utils.rate_limiter import ChatRateLimiter, RateLimitMiddleware
+from app.utils.request_logging import RequestLoggingMiddleware
+from app.utils.token_quota import QuotaExceeded, TokenQuota
 from fastapi import Depends
 
-rate_limiter = RateLimiter(requests_per_minute=60)
+rate_limiter = ChatRateLimiter()
 
 # Create logs directory if it doesn't exist
 os.makedirs("logs", exist_ok=True)
@@ -24,6 +36,62 @@ app = FastAPI(title="Talk2Me API", description="Health assistant chatbot API for
 # Initialize services
 chat_service = ChatService()
 detection_service = DetectionService()
+session_store = create_session_store()
+token_quota = TokenQuota()
+upstream_bulkhead = Bulkhead()
+chat_pipeline = ChatPipeline(chat_service, detection_service, session_store, token_quota, upstream_bulkhead)
+
+# Table sizes, read when metrics are snapshotted
+metrics_registry.gauge_callback(
+    "talk2me_rate_limiter_keys", "Client keys tracked by each local rate limit", ("limit",),
+    lambda: {(name,): size for name, size in rate_limiter.size.items()}
+)
+metrics_registry.gauge_callback(
+    "talk2me_sessions", "Conversation sessions held in memory", (),
+    lambda: {(): session_store.stats().get("sessions", 0)}
+)
+metrics_registry.gauge_callback(
+    "talk2me_token_quota_keys", "Token quota buckets tracked", (), lambda: {(): token_quota.size}
+)
+# Upstream saturation, for autoscaling
+metrics_registry.gauge_callback(
+    "talk2me_upstream_in_flight", "Chat turns holding an upstream slot", (), lambda: {(): upstream_bulkhead.active}
+)
+metrics_registry.gauge_callback(
+    "talk2me_upstream_queue_depth", "Chat turns waiting for an upstream slot", (), lambda: {(): upstream_bulkhead.queued}
+)
+metrics_registry.gauge_callback(
+    "talk2me_upstream_timeout_seconds", "Current adaptive DeepSeek timeout per phase", ("phase",),
+    lambda: {(phase,): seconds for phase, seconds in chat_service.timeouts.stats().items()}
+)
+metrics_registry.gauge_callback(
+    "talk2me_log_queue_depth", "Log records waiting for the writer thread", (), lambda: {(): log_stats()["queued"]}
+)
+metrics_registry.gauge_callback(
+    "talk2me_log_dropped_records", "Log records dropped because the queue was full", (), lambda: {(): log_stats()["dropped"]}
+)
+
+@app.on_event("startup")
+async def startup():
+    # Open the pooled upstream connection once per worker
+    await chat_service.startup()
+    # Load langdetect profiles now rather than on the first chat request
+    await asyncio.to_thread(preload_language_profiles)
+    # Periodic snapshot for /metrics aggregation across workers (METRICS_DIR)
+    metrics_registry.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await chat_service.shutdown()
+    await session_store.close()
+    await rate_limiter.close()
+    await token_quota.close()
+    await metrics_registry.stop()
+
+# Middleware added last runs first: CORS, then rate limiting, then request logging,
+# so rejected requests are never read or logged but still carry CORS headers
+app.add_middleware(RequestLoggingMiddleware)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 
 # Enable CORS - updated to be more permissive for development
 app.add_middleware(
@@ -32,30 +100,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],  # Explicitly define allowed methods
     allow_headers=["*"],
+    # Let the frontend read latency and tracing headers
+    expose_headers=["Server-Timing", "X-Request-ID", "Retry-After"],
 )
 
-# Middleware for request logging
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    request_id = str(time.time())
-    logger.info(f"Request {request_id} started: {request.method} {request.url.path}")
-    
-    # Add debug information for potential CORS issues
-    origin = request.headers.get("origin", "No Origin")
-    logger.info(f"Request origin: {origin}")
-    
-    try:
-        response = await call_next(request)
-        logger.info(f"Request {request_id} completed with status code {response.status_code}")
-        return response
-    except Exception as e:
-        logger.error(f"Request {request_id} failed with error: {str(e)}")
-        logger.error(traceback.format_exc())
-        return JSONResponse(
-            status_code=500,
-            content={"detail": "Internal server error"}
-        )
-
 @app.get("/")
 async def root():
     logger.info("Root endpoint accessed")
@@ -72,72 +120,162 @@ async def health_check():
         "status": "healthy", 
         "timestamp": time.time(),
         "api_mode": api_mode,
-        "api_key_configured": has_api_key
+        "api_key_configured": has_api_key,
+        "sessions": session_store.stats(),
+        "rate_limiter_keys": rate_limiter.size,
+        "token_quota": token_quota.stats(),
+        "circuit": chat_service.breaker.stats(),
+        "upstream_timeouts": chat_service.timeouts.stats(),
+        "upstream_bulkhead": upstream_bulkhead.stats(),
+        "logging": log_stats()
+    }
+
+def require_debug_token(request: Request):
+    """Debug endpoints exist only when DEBUG_CAPTURE_TOKEN is set and presented as X-Debug-Token."""
+    expected = os.getenv("DEBUG_CAPTURE_TOKEN")
+    presented = request.headers.get("x-debug-token", "")
+    if not expected or not secrets.compare_digest(presented, expected):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return True
+
+@app.get("/debug/captures", dependencies=[Depends(require_debug_token)])
+async def debug_captures(session_id: str = None, limit: int = 50):
+    """Recent captured upstream request/response pairs, newest first."""
+    return {
+        "stats": chat_service.debug_capture.stats(),
+        "entries": chat_service.debug_capture.entries(session_id, limit)
     }
 
+@app.post("/debug/sessions/{session_id}", dependencies=[Depends(require_debug_token)])
+async def flag_debug_session(session_id: str):
+    """Capture every upstream call made for this session from now on."""
+    chat_service.debug_capture.flag(session_id)
+    return {"flagged": session_id}
+
+@app.delete("/debug/sessions/{session_id}", dependencies=[Depends(require_debug_token)])
+async def unflag_debug_session(session_id: str):
+    chat_service.debug_capture.unflag(session_id)
+    return {"unflagged": session_id}
+
+def quota_exceeded(exc):
+    """429 for a spent token budget, telling the client when it will have refilled."""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Token quota exceeded. Please try again later.",
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+def service_overloaded(exc):
+    """503 for a turn shed by the upstream bulkhead."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The service is busy right now. Please try again in a moment.",
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint, merged across workers when METRICS_DIR is set."""
+    own = metrics_registry.snapshot()
+    body = await asyncio.to_thread(metrics_registry.render, own)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+def sse_event(event, data):
+    """Format one server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/api/chat", response_model=MessageResponse)
-async def chat(
-    request: MessageRequest, 
-    _: bool = Depends(rate_limiter)  # Apply rate limiting
-):
-    logger.info(f"Chat request received, message length: {len(request.message)}")
-    
-    user_message = request.message
+async def chat(request: MessageRequest, http_request: Request):
+    logger.info("Chat request received, message length: %s", len(request.message))
     
-    # Detect crisis 
-    crisis_detected = detection_service.detect_crisis(user_message)
-    if crisis_detected:
-        logger.warning(f"Crisis detected in message: {user_message[:50]}...")
-    
-    # Detect language
-    language = detect_language(user_message)
-    logger.info(f"Detected language: {language}")
+    try:
+        response = await chat_pipeline.run(
+            request.message,
+            session_id=request.session_id,
+            is_disconnected=http_request.is_disconnected,
+            user_key=request.user_id
+        )
+    except QuotaExceeded as e:
+        raise quota_exceeded(e)
+    except BulkheadFull as e:
+        raise service_overloaded(e)
+    except ClientDisconnected:
+        # Nobody is listening any more; 499 is the conventional "client closed request" code
+        return Response(status_code=499)
+    except asyncio.TimeoutError:
+        response = MessageResponse(message=TIMEOUT_MESSAGE)
     
-    # Categorize message
-    categories = detection_service.categorize_message(user_message)
-    if crisis_detected and "crisis" not in categories:
-        categories.append("crisis")
+    # Serialized here rather than by response_model so the stage can be timed
+    with stage("serialization"):
+        body = response.model_dump_json()
+    return Response(body, media_type="application/json")
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: MessageRequest):
+    """Stream the reply as server-sent events.
     
-    logger.info(f"Detected categories: {categories}")
+    Emits one `meta` event with topics, crisis flag and resources before the
+    upstream call, then a `token` event per delta and a final `done` event.
+    Starlette cancels the generator if the client disconnects. The upstream
+    slot is held until the response has been sent.
+    """
+    logger.info("Streaming chat request received, message length: %s", len(request.message))
     
-    # Get resources
-    resources = detection_service.get_related_resources(categories)
+    user_message = request.message
+    deadline = chat_pipeline.new_deadline()
+    context = await chat_pipeline.prepare(user_message, deadline, request.session_id)
+    try:
+        slot = await chat_pipeline.admit(deadline)
+    except BulkheadFull as e:
+        if not context.crisis_detected:
+            raise service_overloaded(e)
+        # Crisis turns still get their resources, with the fallback as the reply
+        logger.warning("No upstream slot for a crisis turn, streaming the fallback and its resources")
+        slot = None
     
-    # Generate appropriate system message
-    system_message = chat_service.generate_system_message(categories, crisis_detected)
+    reservation = None
+    if slot is not None:
+        try:
+            reservation = await chat_pipeline.reserve_tokens(context, user_message, request.user_id or request.session_id)
+        except QuotaExceeded as e:
+            slot.release()
+            raise quota_exceeded(e)
     
-    try:
-        # Get response from DeepSeek API
-        ai_response = chat_service.get_chat_response(user_message, system_message)
+    async def event_stream():
+        yield sse_event("meta", {
+            "detected_topics": context.categories,
+            "crisis_detected": context.crisis_detected,
+            "resources": context.resources
+        })
         
-        logger.info("Successfully generated AI response")
+        if slot is None:
+            yield sse_event("token", {"delta": FALLBACK_MESSAGE})
+            yield sse_event("done", {})
+            return
         
-        response = MessageResponse(
-            message=ai_response,
-            detected_topics=categories,
-            crisis_detected=crisis_detected,
-            resources=resources
-        )
-        
-        return response
-    except Exception as e:
-        logger.error(f"Error generating AI response: {str(e)}")
-        logger.error(traceback.format_exc())
+        try:
+            with slot:
+                async for delta in chat_pipeline.stream_reply(user_message, context, deadline, reservation):
+                    yield sse_event("token", {"delta": delta})
+        except Exception as e:
+            logger.error("Error streaming AI response: %s", str(e))
+            logger.error(traceback.format_exc())
+            yield sse_event("token", {"delta": FALLBACK_MESSAGE})
         
-        # Return a more graceful error response
-        error_response = MessageResponse(
-            message="I'm having trouble connecting to my AI service right now. Please try again in a moment.",
-            detected_topics=categories,
-            crisis_detected=crisis_detected,
-            resources=resources
-        )
-        
-        return error_response
+        yield sse_event("done", {})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also frees the slot if the stream never started (client gone before the first send)
+        background=BackgroundTask(slot.release) if slot is not None else None
+    )
 
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Uncaught exception: {str(exc)}")
+    logger.error("Uncaught exception: %s", str(exc))
     logger.error(traceback.format_exc())
     return JSONResponse(
         status_code=500,
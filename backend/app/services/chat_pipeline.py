@@ -0,0 +1,322 @@
+# app/services/chat_pipeline.py
+import asyncio
+import contextvars
+import os
+import time
+import traceback
+from contextlib import nullcontext
+from typing import Dict, List, NamedTuple, Optional
+from app.models import MessageResponse
+from app.services.chat_service import FALLBACK_RESPONSES, MAX_TOKENS, TIMEOUT_RESPONSE
+from app.utils.bulkhead import BulkheadFull
+from app.utils.circuit_breaker import CircuitOpen
+from app.utils.deadline import Deadline
+from app.utils.helpers import detect_language, estimate_tokens
+from app.utils.log_context import bind, record_timing, stage
+from app.utils.metrics import UPSTREAM_ERRORS
+from app.utils.logger import logger
+
+FALLBACK_MESSAGE = "I'm having trouble connecting to my AI service right now. Please try again in a moment."
+TIMEOUT_MESSAGE = TIMEOUT_RESPONSE
+
+class ClientDisconnected(Exception):
+    """The client went away before the reply was ready."""
+
+class ChatContext(NamedTuple):
+    categories: List[str]
+    crisis_detected: bool
+    resources: List[Dict]
+    system_message: str
+    language: Optional[str] = None
+    session_id: Optional[str] = None
+    history: List[Dict] = []
+
+class ChatPipeline:
+    """Runs one chat turn as explicit stages under a single request deadline.
+
+    Stages: language detection (worker thread, only when a prompt uses it) and
+    the session history read run concurrently with crisis/topic detection and
+    resource lookup; the prompt waits for them and is sent with the history;
+    the turn's estimated token cost is charged against the token quota; the
+    upstream call gets whatever time is left. Outstanding stages are
+    cancelled when the deadline passes or the client disconnects. While the
+    upstream circuit is open the turn is answered at once with the fallback
+    text, still carrying the detected topics, crisis flag and resources.
+    With a bulkhead, the turn must be admitted to an upstream slot before its
+    tokens are reserved; BulkheadFull is raised if it cannot be in time,
+    except for crisis turns, which get the fallback text and their resources.
+    """
+
+    def __init__(self, chat_service, detection_service, session_store=None, token_quota=None, bulkhead=None):
+        self.chat_service = chat_service
+        self.detection_service = detection_service
+        self.session_store = session_store
+        self.token_quota = token_quota
+        self.bulkhead = bulkhead
+        self.request_timeout = float(os.getenv("CHAT_REQUEST_TIMEOUT", "25"))
+        self.language_timeout = float(os.getenv("LANGUAGE_STAGE_TIMEOUT", "0.5"))
+        self.history_timeout = float(os.getenv("HISTORY_STAGE_TIMEOUT", "0.3"))
+        self.disconnect_poll_interval = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.25"))
+        self._background = set()
+
+    def new_deadline(self):
+        return Deadline(self.request_timeout)
+
+    def analyze_message(self, user_message):
+        """Run crisis/topic detection and resolve the related resources."""
+        # Detect crisis and categorize message in a single pass
+        detection = self.detection_service.scan(user_message)
+        crisis_detected = detection.crisis_detected
+        if crisis_detected:
+            logger.warning("Crisis detected in message: %s...", user_message[:50])
+
+        categories = detection.categories
+        if crisis_detected and "crisis" not in categories:
+            categories.append("crisis")
+
+        logger.info("Detected categories: %s", categories)
+
+        # Get resources
+        resources = self.detection_service.get_related_resources(categories)
+
+        return categories, crisis_detected, resources
+
+    async def _detect_language(self, user_message, deadline):
+        """Language stage: None when nothing consumes it or it misses its budget."""
+        if not self.chat_service.language_aware_prompts:
+            return None
+        with stage("language"):
+            # Submitted to the executor right away, on this task's first step; to_thread
+            # under wait_for would only start the thread a loop iteration later
+            context = contextvars.copy_context()
+            work = asyncio.get_running_loop().run_in_executor(None, context.run, detect_language, user_message)
+            try:
+                language = await asyncio.wait_for(work, timeout=deadline.stage_timeout(self.language_timeout))
+            except asyncio.TimeoutError:
+                logger.warning("Language detection missed its stage deadline, continuing without it")
+                return None
+            logger.info("Detected language: %s", language)
+        return language
+
+    async def _load_history(self, session_id, deadline):
+        """History stage: one store round trip, empty on a miss or a blown budget."""
+        if not session_id or self.session_store is None:
+            return []
+        with stage("history"):
+            try:
+                return await asyncio.wait_for(
+                    self.session_store.history(session_id),
+                    timeout=deadline.stage_timeout(self.history_timeout)
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Session history missed its stage deadline, continuing without it")
+                return []
+
+    def remember_turn(self, context, user_message, ai_response):
+        """Append a completed exchange to the session in the background.
+        
+        Canned failure replies are skipped, and the write never delays the response.
+        """
+        if not context.session_id or self.session_store is None:
+            return
+        if ai_response in FALLBACK_RESPONSES or ai_response == FALLBACK_MESSAGE:
+            return
+        task = asyncio.create_task(self.session_store.append_turn(context.session_id, user_message, ai_response))
+        # Keep a reference until done so the write is not garbage collected mid-flight
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def admit(self, deadline):
+        """Admission stage: hold an upstream slot (a context manager) for the rest of the turn.
+
+        Raises BulkheadFull when none frees up within the queueing limit or the deadline.
+        """
+        if self.bulkhead is None:
+            return nullcontext()
+        with stage("admission"):
+            return await self.bulkhead.acquire(timeout=deadline.remaining())
+
+    async def reserve_tokens(self, context, user_message, user_key=None):
+        """Quota stage: pre-charge the turn's estimated cost before the upstream call.
+
+        Raises QuotaExceeded when a budget is spent. Crisis turns are charged
+        but never refused. Returns None when no quota is configured.
+        """
+        if self.token_quota is None:
+            return None
+        estimate = self.chat_service.estimate_cost(user_message, context.system_message, context.history)
+        return await self.token_quota.reserve_shared(user_key, estimate, force=context.crisis_detected)
+
+    async def settle_tokens(self, reservation, usage, ai_response):
+        """Reconcile a reservation against the `usage` block the upstream reported."""
+        if reservation is None:
+            return
+        actual = usage.get("total_tokens")
+        if actual is None:
+            # No usage reported (mock mode, failed call): charge the prompt and whatever came back
+            actual = reservation.estimate - MAX_TOKENS
+            if ai_response not in FALLBACK_RESPONSES:
+                actual += estimate_tokens(ai_response)
+        await self.token_quota.reconcile_shared(reservation, actual)
+
+    async def release_tokens(self, reservation):
+        """Refund a reservation for a turn that never reached the upstream."""
+        if reservation is not None:
+            await self.token_quota.reconcile_shared(reservation, 0)
+
+    async def prepare(self, user_message, deadline, session_id=None):
+        """Classification, language, history and prompt stages."""
+        if session_id:
+            bind(session_id=session_id)
+        language_task = asyncio.create_task(self._detect_language(user_message, deadline))
+        history_task = asyncio.create_task(self._load_history(session_id, deadline))
+        try:
+            # Tasks only start once the loop gets control: yield so the language thread and
+            # history read are under way before the (synchronous) detection scan
+            await asyncio.sleep(0)
+            with stage("detection"):
+                categories, crisis_detected, resources = self.analyze_message(user_message)
+            language, history = await asyncio.gather(language_task, history_task)
+        finally:
+            language_task.cancel()
+            history_task.cancel()
+
+        # Generate appropriate system message
+        with stage("prompt"):
+            system_message = self.chat_service.generate_system_message(categories, crisis_detected, language)
+        return ChatContext(categories, crisis_detected, resources, system_message, language, session_id, history)
+
+    async def _generate(self, context, user_message, deadline, user_key):
+        """Quota and upstream stages; returns the reply text (a fallback on failure)."""
+        reservation = await self.reserve_tokens(context, user_message, user_key)
+
+        usage = {}
+        try:
+            # Get response from DeepSeek API within the remaining request budget
+            remaining = deadline.remaining()
+            with stage("upstream"):
+                ai_response = await asyncio.wait_for(
+                    self.chat_service.get_chat_response(
+                        user_message, context.system_message, timeout=remaining, history=context.history,
+                        on_usage=usage.update
+                    ),
+                    timeout=remaining
+                )
+            logger.info("Successfully generated AI response")
+            self.remember_turn(context, user_message, ai_response)
+            await self.settle_tokens(reservation, usage, ai_response)
+        except CircuitOpen as e:
+            logger.warning("Upstream circuit open, answering with the fallback (retry in %.1fs)", e.retry_after)
+            ai_response = FALLBACK_MESSAGE
+            await self.release_tokens(reservation)
+        except asyncio.TimeoutError:
+            # The upstream may still be generating, so the full estimate stays charged
+            logger.error("Upstream stage hit the request deadline after %.2fs", deadline.elapsed())
+            UPSTREAM_ERRORS.inc("deadline")
+            ai_response = TIMEOUT_MESSAGE
+        except Exception as e:
+            logger.error("Error generating AI response: %s", str(e))
+            logger.error(traceback.format_exc())
+            # Return a more graceful error response
+            ai_response = FALLBACK_MESSAGE
+            await self.settle_tokens(reservation, usage, ai_response)
+        return ai_response
+
+    async def _respond(self, user_message, deadline, session_id, user_key):
+        context = await self.prepare(user_message, deadline, session_id)
+        try:
+            slot = await self.admit(deadline)
+        except BulkheadFull:
+            if not context.crisis_detected:
+                raise
+            logger.warning("No upstream slot for a crisis turn, answering with the fallback and its resources")
+            ai_response = FALLBACK_MESSAGE
+        else:
+            with slot:
+                ai_response = await self._generate(context, user_message, deadline, user_key or session_id)
+
+        return MessageResponse(
+            message=ai_response,
+            detected_topics=context.categories,
+            crisis_detected=context.crisis_detected,
+            resources=context.resources
+        )
+
+    async def _watch_disconnect(self, is_disconnected):
+        while not await is_disconnected():
+            await asyncio.sleep(self.disconnect_poll_interval)
+
+    async def run(self, user_message, session_id=None, is_disconnected=None, deadline=None, user_key=None):
+        """Run every stage for one turn and return the MessageResponse.
+
+        `is_disconnected` is an async callable (e.g. `Request.is_disconnected`);
+        when it reports the client gone, remaining work is cancelled and
+        ClientDisconnected is raised. `user_key` picks the per-user token
+        budget (defaults to the session). Raises QuotaExceeded when a token
+        budget cannot cover the turn, and BulkheadFull when no upstream slot
+        frees up in time.
+        """
+        deadline = deadline or self.new_deadline()
+        work = asyncio.create_task(self._respond(user_message, deadline, session_id, user_key))
+        tasks = {work}
+        watcher = None
+        if is_disconnected is not None:
+            watcher = asyncio.create_task(self._watch_disconnect(is_disconnected))
+            tasks.add(watcher)
+
+        try:
+            # Small grace over the deadline so the upstream stage can report its own timeout
+            done, _ = await asyncio.wait(tasks, timeout=deadline.remaining() + 0.5, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if work in done:
+            return work.result()
+        if watcher is not None and watcher in done:
+            logger.info("Client disconnected after %.2fs, cancelled outstanding stages", deadline.elapsed())
+            raise ClientDisconnected()
+
+        logger.error("Request deadline of %ss exceeded, cancelled outstanding stages", deadline.timeout)
+        raise asyncio.TimeoutError()
+
+    async def stream_reply(self, user_message, context, deadline, reservation=None):
+        """Yield reply deltas, stopping with a timeout notice once the deadline passes.
+
+        `reservation` (from `reserve_tokens`) is reconciled once the stream completes.
+        Records `first_token` and `upstream` timings for the request.
+        """
+        started = time.perf_counter()
+        usage = {}
+        stream = self.chat_service.stream_chat_response(
+            user_message, context.system_message, timeout=deadline.remaining(), history=context.history,
+            on_usage=usage.update
+        )
+        parts = []
+        try:
+            while True:
+                try:
+                    delta = await asyncio.wait_for(stream.__anext__(), timeout=deadline.remaining())
+                except StopAsyncIteration:
+                    break
+                except CircuitOpen as e:
+                    logger.warning("Upstream circuit open, streaming the fallback (retry in %.1fs)", e.retry_after)
+                    await self.release_tokens(reservation)
+                    yield FALLBACK_MESSAGE
+                    return
+                except asyncio.TimeoutError:
+                    logger.error("Streaming reply hit the request deadline after %.2fs", deadline.elapsed())
+                    UPSTREAM_ERRORS.inc("deadline")
+                    yield TIMEOUT_MESSAGE
+                    return
+                if not parts:
+                    record_timing("first_token", time.perf_counter() - started)
+                parts.append(delta)
+                yield delta
+        finally:
+            record_timing("upstream", time.perf_counter() - started)
+            await stream.aclose()
+
+        ai_response = "".join(parts)
+        self.remember_turn(context, user_message, ai_response)
+        await self.settle_tokens(reservation, usage, ai_response)
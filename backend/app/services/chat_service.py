@@ -1,9 +1,18 @@
 # app/services/chat_service.py
+import asyncio
 import os
-import requests
+import time
+import httpx
 import json
-from app.utils.helpers import safe_get
+from app.services.deepseek_client import DeepSeekClient
+from app.utils.adaptive_timeout import AdaptiveTimeouts
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.debug_capture import DebugCapture
+from app.utils.hedging import Hedger
+from app.utils.helpers import estimate_tokens, safe_get
 from app.utils.logger import logger
+from app.utils.retry import RetryPolicy
+from app.utils.metrics import TOKENS_USED, UPSTREAM_ERRORS, UPSTREAM_RESPONSES
 
 # Try to import mock responses, but don't fail if not available
 try:
@@ -11,6 +20,19 @@ try:
 except ImportError:
     def get_mock_response(msg): return "Mock response fallback"
 
+# Canned replies used when the upstream call fails; never stored as conversation history
+ERROR_RESPONSE = "Sorry, there was an error connecting to the AI service. Please try again later."
+EMPTY_RESPONSE = "Hey, I'm having trouble coming up with a good response right now. Could you try asking me something else or rephrasing your question?"
+TIMEOUT_RESPONSE = "Sorry, it's taking longer than expected to process your request. The servers might be busy. Could you try again in a moment?"
+CONNECTION_RESPONSE = "I'm having a hard time connecting right now. My servers might be down or experiencing issues. Can we try again in a bit?"
+UNEXPECTED_RESPONSE = "Something unexpected happened. Please try again later."
+FALLBACK_RESPONSES = frozenset({ERROR_RESPONSE, EMPTY_RESPONSE, TIMEOUT_RESPONSE, CONNECTION_RESPONSE, UNEXPECTED_RESPONSE})
+
+# Ceiling on reply length; also the completion share of a turn's pre-charged token cost
+MAX_TOKENS = 500
+
+DEFAULT_SYSTEM_MESSAGE = "You are Talk2Me, a friendly and supportive healthcare assistant for Gen Z users. Use casual, conversational language appropriate for teens and young adults. Keep responses concise, authentic, and supportive."
+
 class ChatService:
     """Service for handling chat interactions with DeepSeek API."""
     
@@ -18,6 +40,23 @@ class ChatService:
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
         self.api_url = "https://api.deepseek.com/v1/chat/completions"
         self.mock_mode = os.getenv("MOCK_MODE", "false").lower() == "true"
+        # Connect, first-byte and total timeouts that follow recent upstream latency
+        self.timeouts = AdaptiveTimeouts()
+        self.client = DeepSeekClient(
+            self.api_key,
+            timeout=self.timeouts.for_attempt(),
+            on_connect=lambda seconds: self.timeouts.observe("connect", seconds)
+        )
+        # Language detection only runs when the prompt actually uses it
+        self.language_aware_prompts = os.getenv("LANGUAGE_AWARE_PROMPTS", "false").lower() == "true"
+        # Full request/response capture for sampled traffic and flagged sessions
+        self.debug_capture = DebugCapture()
+        # Fails fast while DeepSeek is down or too slow to be worth waiting for
+        self.breaker = CircuitBreaker("deepseek")
+        # Retries transient failures within the caller's timeout; the breaker sees one call
+        self.retry_policy = RetryPolicy()
+        # Optional second attempt when the first is slower than the recent p90
+        self.hedger = Hedger()
         
         if not self.api_key and not self.mock_mode:
             logger.warning("DEEPSEEK_API_KEY not set and mock mode is disabled")
@@ -28,7 +67,7 @@ class ChatService:
         else:
             logger.info("Running in LIVE MODE - API calls will be made to DeepSeek")
     
-    def generate_system_message(self, categories, crisis_detected):
+    def generate_system_message(self, categories, crisis_detected, language=None):
         """Generate appropriate system message based on detected topics."""
         system_message = "You are Talk2Me, a friendly and supportive health assistant for Gen Z users. "
         
@@ -43,61 +82,132 @@ class ChatService:
         
         system_message += " Use casual, conversational language appropriate for teens and young adults. Keep responses concise (under 150 words), authentic, and supportive."
         
+        if language and language != "en":
+            system_message += f" The user is writing in the language with ISO code '{language}'; reply in that language."
+        
         return system_message
     
-    def get_chat_response(self, user_message, system_message=None):
-        """Get response from DeepSeek API or mock responses in test mode."""
+    async def startup(self):
+        """Open the upstream connection pool (no-op in mock mode)."""
+        if not self.mock_mode:
+            await self.client.start()
+    
+    async def shutdown(self):
+        """Close the upstream connection pool."""
+        await self.client.aclose()
+    
+    def build_payload(self, user_message, system_message=None, history=None):
+        """Build the DeepSeek chat completion payload.
+        
+        `history` is a list of earlier {"role", "content"} turns, oldest first.
+        """
         if not system_message:
-            system_message = "You are Talk2Me, a friendly and supportive healthcare assistant for Gen Z users. Use casual, conversational language appropriate for teens and young adults. Keep responses concise, authentic, and supportive."
+            system_message = DEFAULT_SYSTEM_MESSAGE
+        
+        return {
+            "model": "deepseek-chat",
+            "messages": [
+                {"role": "system", "content": system_message},
+                *(history or []),
+                {"role": "user", "content": user_message}
+            ],
+            "temperature": 0.7,
+            "max_tokens": MAX_TOKENS  # Limit response length
+        }
+    
+    def estimate_cost(self, user_message, system_message=None, history=None):
+        """Upper bound on a turn's token cost: the estimated prompt plus the max_tokens ceiling."""
+        payload = self.build_payload(user_message, system_message, history)
+        return sum(estimate_tokens(message["content"]) for message in payload["messages"]) + MAX_TOKENS
+    
+    def _is_upstream_failure(self, status_code):
+        """Statuses that count against the circuit: overload and server errors."""
+        return status_code == 429 or status_code >= 500
+    
+    async def _attempt(self, phase, call, payload, remaining):
+        """One upstream attempt under the adaptive `phase` timeout; successes feed its latency window.
+        
+        The phase budget is a wall-clock limit on the whole attempt (for a
+        stream, up to its first token frame), so keep-alive padding cannot
+        stretch it; running out raises httpx.TimeoutException like a read timeout.
+        """
+        started = time.monotonic()
+        budget = self.timeouts.budget(phase, remaining)
+        try:
+            response = await asyncio.wait_for(call(payload, timeout=self.timeouts.for_attempt(remaining)), budget)
+        except asyncio.TimeoutError:
+            raise httpx.TimeoutException(f"DeepSeek {phase} budget of {budget:.2f}s exceeded")
+        if response.status_code == 200:
+            self.timeouts.observe(phase, time.monotonic() - started)
+        return response
+    
+    async def _send(self, payload, timeout=None):
+        """One chat completion call: retried, and each attempt hedged when hedging is on."""
+        return await self.retry_policy.run(
+            lambda remaining: self.hedger.run(
+                lambda left: self._attempt("total", self.client.create_chat_completion, payload, left), remaining
+            ),
+            timeout
+        )
+    
+    async def _open_stream(self, payload, timeout=None):
+        """Like `_send` for a stream, up to its first token frame."""
+        return await self.retry_policy.run(
+            lambda remaining: self.hedger.run(
+                lambda left: self._attempt("first_byte", self.client.open_chat_completion_stream, payload, left),
+                remaining
+            ),
+            timeout
+        )
+    
+    def _record_usage(self, usage, on_usage=None):
+        """Count the tokens in a `usage` block and pass it on to the caller."""
+        TOKENS_USED.inc("prompt", amount=usage.get("prompt_tokens") or 0)
+        TOKENS_USED.inc("completion", amount=usage.get("completion_tokens") or 0)
+        if on_usage:
+            on_usage(usage)
+    
+    async def get_chat_response(self, user_message, system_message=None, timeout=None, history=None, on_usage=None):
+        """Get response from DeepSeek API or mock responses in test mode.
         
+        `timeout` overrides the client default, e.g. with a request's remaining deadline.
+        `on_usage` is called with the response's `usage` block (token counts) when present.
+        Raises CircuitOpen, without calling the API, while the upstream circuit is open.
+        """
         # If in mock mode, return a mock response
         if self.mock_mode:
             logger.info("Using mock response in mock mode")
             mock_response = get_mock_response(user_message)
-            logger.info(f"Generated mock response for: {user_message[:30]}...")
+            logger.info("Generated mock response for: %s...", user_message[:30])
             return mock_response
         
         # Log the API key length (for debugging, don't log the actual key)
         api_key_status = "Not Set" if not self.api_key else f"Set (length: {len(self.api_key)})"
-        logger.info(f"Using DeepSeek API. API Key status: {api_key_status}")
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        logger.info("Using DeepSeek API. API Key status: %s", api_key_status)
         
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 500  # Limit response length
-        }
+        permit = self.breaker.before_call()
+        payload = self.build_payload(user_message, system_message, history)
+        capture = self.debug_capture.begin(payload)
+        failed = None
         
         try:
-            logger.info(f"Sending request to DeepSeek API: {self.api_url}")
-            response = requests.post(
-                self.api_url, 
-                headers=headers,
-                json=payload,
-                timeout=20  # Increased timeout for API calls
-            )
+            logger.info("Sending request to DeepSeek API: %s", self.api_url)
+            response = await self._send(payload, timeout)
+            logger.info("DeepSeek API response status: %s", response.status_code)
+            UPSTREAM_RESPONSES.inc(str(response.status_code))
+            failed = self._is_upstream_failure(response.status_code)
             
-            # Log response status and headers for debugging
-            logger.info(f"DeepSeek API response status: {response.status_code}")
-            logger.info(f"DeepSeek API response headers: {dict(response.headers)}")
+            if capture is not None:
+                self.debug_capture.finish(capture, response.status_code, dict(response.headers), response.text)
             
             if response.status_code != 200:
-                logger.error(f"DeepSeek API error: {response.text}")
-                return "Sorry, there was an error connecting to the AI service. Please try again later."
+                logger.error("DeepSeek API error: %s", response.text)
+                return ERROR_RESPONSE
             
             data = response.json()
-            logger.info(f"DeepSeek API response data structure: {list(data.keys())}")
             
-            # Log more detailed structure of the response for debugging
-            logger.info(f"Full response structure: {json.dumps(data, indent=2)[:500]}...")
+            if isinstance(data.get("usage"), dict):
+                self._record_usage(data["usage"], on_usage)
             
             # Try multiple paths to extract the content
             ai_response = None
@@ -129,25 +239,140 @@ class ChatService:
                 for key, value in data.items():
                     if isinstance(value, str) and len(value) > 20:  # Look for substantial text
                         ai_response = value
-                        logger.info(f"Extracted response from field: {key}")
+                        logger.info("Extracted response from field: %s", key)
                         break
             
             if not ai_response:
                 logger.warning("Empty or missing response from DeepSeek API")
-                return "Hey, I'm having trouble coming up with a good response right now. Could you try asking me something else or rephrasing your question?"
+                return EMPTY_RESPONSE
             
             logger.info("Received valid response from DeepSeek API")
-            logger.info(f"Response length: {len(ai_response)} characters")
+            logger.info("Response length: %s characters", len(ai_response))
             return ai_response
             
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException as e:
             logger.error("Timeout error calling DeepSeek API")
-            return "Sorry, it's taking longer than expected to process your request. The servers might be busy. Could you try again in a moment?"
+            UPSTREAM_ERRORS.inc("timeout")
+            failed = True
+            self.debug_capture.finish(capture, error=repr(e))
+            return TIMEOUT_RESPONSE
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error calling DeepSeek API: {str(e)}")
-            return "I'm having a hard time connecting right now. My servers might be down or experiencing issues. Can we try again in a bit?"
+        except httpx.HTTPError as e:
+            logger.error("Error calling DeepSeek API: %s", str(e))
+            UPSTREAM_ERRORS.inc("connection")
+            failed = True
+            self.debug_capture.finish(capture, error=repr(e))
+            return CONNECTION_RESPONSE
         
         except Exception as e:
-            logger.error(f"Unexpected error in API call: {str(e)}")
-            return "Something unexpected happened. Please try again later."
\ No newline at end of file
+            logger.error("Unexpected error in API call: %s", str(e))
+            UPSTREAM_ERRORS.inc("unexpected")
+            self.debug_capture.finish(capture, error=repr(e))
+            return UNEXPECTED_RESPONSE
+        
+        finally:
+            # failed stays None if the call was cancelled (deadline, disconnect) before an outcome
+            self.breaker.after_call(permit, failed)
+    
+    async def stream_chat_response(self, user_message, system_message=None, timeout=None, history=None, on_usage=None):
+        """Yield response text deltas from the DeepSeek streaming API as they arrive.
+        
+        `on_usage` is called with the `usage` block from the final chunk when present.
+        Raises CircuitOpen, without calling the API, while the upstream circuit is open.
+        """
+        if self.mock_mode:
+            logger.info("Using mock streaming response in mock mode")
+            for word in get_mock_response(user_message).split(" "):
+                yield word + " "
+            return
+        
+        permit = self.breaker.before_call()
+        payload = self.build_payload(user_message, system_message, history)
+        capture = self.debug_capture.begin(payload, stream=True)
+        frames = [] if capture is not None else None
+        failed = None
+        # Judged on time to first token; a long reply is not a slow upstream
+        first_byte = None
+        
+        try:
+            logger.info("Opening streaming request to DeepSeek API: %s", self.api_url)
+            response = await self._open_stream(payload, timeout)
+            try:
+                first_byte = time.monotonic() - permit.started
+                UPSTREAM_RESPONSES.inc(str(response.status_code))
+                failed = self._is_upstream_failure(response.status_code)
+                if response.status_code != 200:
+                    body = await response.aread()
+                    logger.error("DeepSeek API streaming error %s: %r", response.status_code, body[:500])
+                    self.debug_capture.finish(capture, response.status_code, dict(response.headers), body.decode("utf-8", "replace"))
+                    yield ERROR_RESPONSE
+                    return
+                
+                received = 0
+                # The first_byte limit is also the longest wait between data frames; keep-alive
+                # lines do not count, so an upstream that stalls mid-reply is cut off
+                gap = self.timeouts.get("first_byte")
+                last_frame = time.monotonic()
+                lines = response.aiter_lines()
+                while True:
+                    try:
+                        line = await asyncio.wait_for(lines.__anext__(), max(0.0, last_frame + gap - time.monotonic()))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise httpx.TimeoutException(f"DeepSeek stream stalled for {gap:.2f}s")
+                    # SSE frames from DeepSeek look like `data: {...}`; skip keep-alives and blanks
+                    if not line.startswith("data:"):
+                        continue
+                    last_frame = time.monotonic()
+                    data = line[5:].strip()
+                    if frames is not None:
+                        frames.append(data)
+                    if data == "[DONE]":
+                        break
+                    
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        logger.warning("Skipping malformed stream chunk from DeepSeek API")
+                        continue
+                    
+                    if isinstance(chunk.get("usage"), dict):
+                        self._record_usage(chunk["usage"], on_usage)
+                    
+                    delta = safe_get(chunk, ["choices"], [{}])
+                    content = safe_get(delta[0] if delta else {}, ["delta", "content"])
+                    if content:
+                        received += len(content)
+                        yield content
+                
+                logger.info("Streamed response length: %s characters", received)
+                if capture is not None:
+                    self.debug_capture.finish(capture, response.status_code, dict(response.headers), frames)
+                if not received:
+                    yield EMPTY_RESPONSE
+            finally:
+                await response.aclose()
+
+        except httpx.TimeoutException as e:
+            logger.error("Timeout error streaming from DeepSeek API")
+            UPSTREAM_ERRORS.inc("timeout")
+            failed = True
+            self.debug_capture.finish(capture, error=repr(e))
+            yield TIMEOUT_RESPONSE
+        
+        except httpx.HTTPError as e:
+            logger.error("Error streaming from DeepSeek API: %s", str(e))
+            UPSTREAM_ERRORS.inc("connection")
+            failed = True
+            self.debug_capture.finish(capture, error=repr(e))
+            yield CONNECTION_RESPONSE
+        
+        except asyncio.CancelledError:
+            # Cut short by the deadline or a disconnect: an unfinished stream is not a success
+            if failed is False:
+                failed = None
+            raise
+        
+        finally:
+            self.breaker.after_call(permit, failed, first_byte)
@@ -0,0 +1,148 @@
+# app/services/deepseek_client.py
+import os
+import time
+import httpx
+from app.utils.logger import logger
+
+class ChatStream:
+    """An open streaming chat completion, returned once its first data frame has arrived.
+
+    Exposes the response's status and headers; `aiter_lines()` replays the
+    lines already read before continuing with the rest of the body.
+    """
+
+    def __init__(self, response, buffered=()):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._buffered = list(buffered)
+
+    async def aiter_lines(self):
+        for line in self._buffered:
+            yield line
+        async for line in self._lines:
+            yield line
+
+    async def _read_first_frame(self):
+        self._lines = self.response.aiter_lines()
+        async for line in self._lines:
+            self._buffered.append(line)
+            if line.startswith("data:"):
+                return
+
+    async def aread(self):
+        return await self.response.aread()
+
+    async def aclose(self):
+        await self.response.aclose()
+
+class DeepSeekClient:
+    """Async client for the DeepSeek chat completions API.
+
+    Holds one pooled, keep-alive (HTTP/2 when available) connection set for the
+    life of the process, so concurrent chats share sockets instead of paying a
+    TCP + TLS handshake per request.
+    """
+
+    def __init__(self, api_key, base_url="https://api.deepseek.com", timeout=20.0, on_connect=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        # Called with the seconds each new connection took to set up (TCP + TLS)
+        self.on_connect = on_connect
+        self.max_connections = int(os.getenv("DEEPSEEK_MAX_CONNECTIONS", "100"))
+        self.max_keepalive = int(os.getenv("DEEPSEEK_MAX_KEEPALIVE", "20"))
+        self._client = None
+
+    def _build_client(self):
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+
+        logger.info("Opening DeepSeek connection pool (http2=%s, max_connections=%s)", http2, self.max_connections)
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            http2=http2,
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=60.0
+            )
+        )
+
+    @property
+    def client(self):
+        """Lazily create the shared AsyncClient inside the running event loop."""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self):
+        """Open the connection pool ahead of the first request."""
+        return self.client
+
+    async def aclose(self):
+        """Close the connection pool on shutdown."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("DeepSeek connection pool closed")
+        self._client = None
+
+    def _timeout(self, timeout):
+        """`timeout` is seconds for every phase, an httpx.Timeout, or None for the client default."""
+        if timeout is None:
+            return httpx.USE_CLIENT_DEFAULT
+        return timeout if isinstance(timeout, httpx.Timeout) else httpx.Timeout(timeout)
+
+    def _extensions(self):
+        """httpcore trace hook timing connection setup, when `on_connect` is set."""
+        if self.on_connect is None:
+            return None
+        connected_event = "connection.start_tls.complete" if self.base_url.startswith("https") else "connection.connect_tcp.complete"
+        started = None
+
+        async def trace(event, info):
+            nonlocal started
+            if event == "connection.connect_tcp.started":
+                started = time.monotonic()
+            elif event == connected_event and started is not None:
+                self.on_connect(time.monotonic() - started)
+
+        return {"trace": trace}
+
+    async def create_chat_completion(self, payload, timeout=None):
+        """POST a chat completion request and return the raw httpx response."""
+        return await self.client.post(
+            "/v1/chat/completions", json=payload, timeout=self._timeout(timeout), extensions=self._extensions()
+        )
+
+    async def open_chat_completion_stream(self, payload, timeout=None):
+        """Open a streaming chat completion and return a ChatStream once the first token frame arrives.
+
+        Waiting for the first `data:` frame (not just the headers, which come
+        before the model starts) makes the call's latency time to first token.
+        Error responses are returned as soon as their headers arrive. The
+        caller must `aclose()` the stream. The final chunk before `[DONE]`
+        carries the `usage` block.
+        """
+        request = self.client.build_request(
+            "POST", "/v1/chat/completions",
+            json={**payload, "stream": True, "stream_options": {"include_usage": True}},
+            timeout=self._timeout(timeout),
+            extensions=self._extensions()
+        )
+        stream = ChatStream(await self.client.send(request, stream=True))
+        if stream.status_code == 200:
+            try:
+                await stream._read_first_frame()
+            except BaseException:
+                await stream.aclose()
+                raise
+        return stream
@@ -1,35 +1,54 @@
+from typing import List, NamedTuple
+from app.utils.keyword_matcher import KeywordHit, KeywordMatcher
+
+# Keywords match whole words only; a trailing * also accepts inflections
+# ("stress*" -> stressed, stressful) and phrases also match hyphenated ("self-harm").
+CRISIS_KEYWORDS = [
+    "suicide", "suicidal", "kill myself", "end my life", "don't want to live",
+    "dont want to live", "self harm*", "hurt myself", "cutting myself", "overdos*"
+]
+
+CATEGORY_KEYWORDS = {
+    "mental_health": ["anxiety", "anxious", "depress*", "stress*", "overwhelm*", "therap*", "counsel*"],
+    "sexual_health": ["sex", "sexual*", "sexy", "sexting", "contracepti*", "protection", "std", "stds", "sti", "stis", "abortion*", "pregnan*"],
+    "substance_use": ["drug*", "alcohol*", "addict*", "smoking", "smoke*", "vape*", "vaping", "marijuana", "weed"],
+    "physical_health": ["exercis*", "workout*", "diet*", "nutrition*", "sleep*", "eating"],
+    "relationships": ["friend*", "partner*", "dating", "breakup*", "break up", "relationship*", "family"]
+}
+
+# Compiled once at import so every request reuses the same matcher
+_matcher = KeywordMatcher({"crisis": CRISIS_KEYWORDS, **CATEGORY_KEYWORDS})
+
+class DetectionResult(NamedTuple):
+    crisis_detected: bool
+    categories: List[str]
+    hits: List[KeywordHit]
+
 class DetectionService:
     """Service for content detection and categorization."""
     
+    @staticmethod
+    def matcher_backend():
+        """Name of the compiled matcher in use ("aho-corasick" or "tokens")."""
+        return _matcher.backend
+    
+    @staticmethod
+    def scan(text):
+        """Detect crisis indicators and topic categories in one pass over the message."""
+        labels, hits = _matcher.scan(text)
+        crisis_detected = "crisis" in labels
+        categories = [label for label in labels if label != "crisis"]
+        return DetectionResult(crisis_detected, categories, hits)
+    
     @staticmethod
     def detect_crisis(text):
         """Detect potential crisis indicators in user message."""
-        crisis_keywords = [
-            "suicide", "kill myself", "end my life", "don't want to live",
-            "self harm", "hurt myself", "cutting myself", "overdose"
-        ]
-        text_lower = text.lower()
-        return any(keyword in text_lower for keyword in crisis_keywords)
+        return DetectionService.scan(text).crisis_detected
     
     @staticmethod
     def categorize_message(text):
         """Categorize the message into relevant health topics."""
-        categories = {
-            "mental_health": ["anxiety", "depression", "stress", "overwhelm", "therapy", "counseling"],
-            "sexual_health": ["sex", "contraception", "protection", "std", "sti", "abortion", "pregnancy"],
-            "substance_use": ["drugs", "alcohol", "addiction", "smoking", "vape", "marijuana", "weed"],
-            "physical_health": ["exercise", "workout", "diet", "nutrition", "sleep", "eating"],
-            "relationships": ["friend", "partner", "dating", "breakup", "relationship", "family"]
-        }
-        
-        text_lower = text.lower()
-        detected_categories = []
-        
-        for category, keywords in categories.items():
-            if any(keyword in text_lower for keyword in keywords):
-                detected_categories.append(category)
-        
-        return detected_categories
+        return DetectionService.scan(text).categories
     
     @staticmethod
     def get_related_resources(categories):
@@ -0,0 +1,289 @@
+# app/services/session_store.py
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from app.utils.helpers import estimate_tokens
+from app.utils.logger import logger
+
+# The shared backend is optional; only needed when SESSION_BACKEND=redis
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Rough fixed cost of one stored turn (tuple, deque slot) on top of its text
+TURN_OVERHEAD_BYTES = 120
+SESSION_OVERHEAD_BYTES = 600
+
+class _Session:
+    __slots__ = ("turns", "last_seen", "bytes")
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.last_seen = time.monotonic()
+        self.bytes = SESSION_OVERHEAD_BYTES
+
+def _turn_bytes(content):
+    return sys.getsizeof(content) + TURN_OVERHEAD_BYTES
+
+def _trim_to_budget(turns, budget):
+    """Newest-first walk over (role, content) turns, returned oldest-first within budget."""
+    messages = []
+    used = 0
+    for role, content in reversed(turns):
+        used += estimate_tokens(content)
+        if used > budget:
+            break
+        messages.append({"role": role, "content": content})
+    messages.reverse()
+    # Start the history on a user turn so the model never sees a dangling reply
+    if messages and messages[0]["role"] == "assistant":
+        messages.pop(0)
+    return messages
+
+class SessionStore(ABC):
+    """Interface for conversation memory keyed by session_id.
+
+    `history` must cost at most one round trip to the backing store, and
+    `append_turn` writes the whole exchange (plus trim and expiry) in one.
+    """
+
+    backend = "none"
+
+    @abstractmethod
+    async def history(self, session_id, token_budget=None):
+        """Return recent turns as chat messages, oldest first, trimmed to the token budget."""
+
+    @abstractmethod
+    async def append_turn(self, session_id, user_message, assistant_message):
+        """Store one user/assistant exchange."""
+
+    @abstractmethod
+    async def clear(self, session_id):
+        """Forget a session."""
+
+    @abstractmethod
+    def stats(self):
+        """Size and overhead figures for the metrics surface."""
+
+    async def close(self):
+        pass
+
+class InMemorySessionStore(SessionStore):
+    """Per-process conversation memory keyed by session_id.
+
+    Each session is a bounded ring buffer of (role, content) turns. Sessions are
+    kept in LRU order and evicted when idle longer than the TTL, when there are
+    more than `max_sessions`, or when the estimated total size exceeds
+    `max_bytes`.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_turns=None, token_budget=None, ttl=None, max_sessions=None, max_bytes=None):
+        self.max_turns = max_turns or int(os.getenv("SESSION_MAX_TURNS", "20"))
+        self.token_budget = token_budget or int(os.getenv("SESSION_TOKEN_BUDGET", "1500"))
+        self.ttl = ttl or float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+        self.max_bytes = max_bytes or int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._operations = 0
+        self._operation_seconds = 0.0
+
+    def _touch(self, session_id, create=False):
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = _Session(self.max_turns)
+            self._sessions[session_id] = session
+            self._bytes += session.bytes
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_seen = time.monotonic()
+        return session
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.bytes
+        self._evictions += 1
+
+    def _evict(self):
+        """Drop idle sessions from the LRU end, then enforce the count and memory caps."""
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.ttl and len(self._sessions) <= self.max_sessions and self._bytes <= self.max_bytes:
+                break
+            self._drop(session_id)
+
+    def _record(self, started):
+        self._operations += 1
+        self._operation_seconds += time.perf_counter() - started
+
+    async def history(self, session_id, token_budget=None):
+        started = time.perf_counter()
+        messages = []
+        with self._lock:
+            self._evict()
+            session = self._touch(session_id)
+            if session is not None:
+                messages = _trim_to_budget(session.turns, token_budget or self.token_budget)
+            self._record(started)
+        return messages
+
+    async def append_turn(self, session_id, user_message, assistant_message):
+        """Store one user/assistant exchange, dropping the oldest turns past max_turns."""
+        started = time.perf_counter()
+        with self._lock:
+            session = self._touch(session_id, create=True)
+            for role, content in (("user", user_message), ("assistant", assistant_message)):
+                if len(session.turns) == session.turns.maxlen:
+                    _, old_content = session.turns[0]
+                    freed = _turn_bytes(old_content)
+                    session.bytes -= freed
+                    self._bytes -= freed
+                session.turns.append((role, content))
+                added = _turn_bytes(content)
+                session.bytes += added
+                self._bytes += added
+            self._evict()
+            self._record(started)
+
+    async def clear(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def stats(self):
+        with self._lock:
+            sessions = len(self._sessions)
+            return {
+                "backend": self.backend,
+                "sessions": sessions,
+                "bytes": self._bytes,
+                "bytes_per_session": self._bytes // sessions if sessions else 0,
+                "evictions": self._evictions,
+                "operations": self._operations,
+                "avg_operation_us": (self._operation_seconds / self._operations * 1e6) if self._operations else 0.0,
+            }
+
+class RedisSessionStore(SessionStore):
+    """Session memory shared by every replica through a Redis-protocol server.
+
+    Each session is one list of compactly encoded turns (a one-letter role
+    code followed by the text). Reads are LRANGE + EXPIRE and writes are
+    RPUSH + LTRIM + EXPIRE, each sent as a single pipelined round trip, so the
+    TTL slides with activity and the list never grows past `max_turns`.
+    Store errors degrade to a stateless turn instead of failing the chat.
+    """
+
+    backend = "redis"
+    ROLE_CODES = {"user": "u", "assistant": "a", "system": "s"}
+    ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+    def __init__(self, url=None, max_turns=None, token_budget=None, ttl=None, key_prefix="talk2me:session:"):
+        if aioredis is None:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package")
+
+        self.url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.max_turns = max_turns or int(os.getenv("SESSION_MAX_TURNS", "20"))
+        self.token_budget = token_budget or int(os.getenv("SESSION_TOKEN_BUDGET", "1500"))
+        self.ttl = int(ttl or float(os.getenv("SESSION_TTL_SECONDS", "1800")))
+        self.key_prefix = key_prefix
+        self.redis = aioredis.from_url(
+            self.url,
+            decode_responses=True,
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25")),
+            socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.25"))
+        )
+
+        self._errors = 0
+        self._operations = 0
+        self._operation_seconds = 0.0
+
+    def _key(self, session_id):
+        return f"{self.key_prefix}{session_id}"
+
+    def _encode(self, role, content):
+        return self.ROLE_CODES[role] + content
+
+    def _decode(self, value):
+        return self.ROLES.get(value[:1], "user"), value[1:]
+
+    def _record(self, started):
+        self._operations += 1
+        self._operation_seconds += time.perf_counter() - started
+
+    async def history(self, session_id, token_budget=None):
+        started = time.perf_counter()
+        key = self._key(session_id)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lrange(key, -self.max_turns, -1)
+                pipe.expire(key, self.ttl)
+                values, _ = await pipe.execute()
+        except aioredis.RedisError as e:
+            self._errors += 1
+            logger.warning("Session store read failed, continuing without history: %s", str(e))
+            return []
+        finally:
+            self._record(started)
+
+        turns = [self._decode(value) for value in values]
+        return _trim_to_budget(turns, token_budget or self.token_budget)
+
+    async def append_turn(self, session_id, user_message, assistant_message):
+        started = time.perf_counter()
+        key = self._key(session_id)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, self._encode("user", user_message), self._encode("assistant", assistant_message))
+                pipe.ltrim(key, -self.max_turns, -1)
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except aioredis.RedisError as e:
+            self._errors += 1
+            logger.warning("Session store write failed, turn not remembered: %s", str(e))
+        finally:
+            self._record(started)
+
+    async def clear(self, session_id):
+        started = time.perf_counter()
+        try:
+            await self.redis.delete(self._key(session_id))
+        except aioredis.RedisError as e:
+            self._errors += 1
+            logger.warning("Session store delete failed, session left to expire: %s", str(e))
+        finally:
+            self._record(started)
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "errors": self._errors,
+            "operations": self._operations,
+            "avg_operation_us": (self._operation_seconds / self._operations * 1e6) if self._operations else 0.0,
+        }
+
+    async def close(self):
+        await self.redis.aclose()
+
+def create_session_store():
+    """Build the store selected by SESSION_BACKEND ("memory" or "redis")."""
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    if backend == "redis":
+        store = RedisSessionStore()
+        logger.info("Session store: redis at %s (max_turns=%s, ttl=%ss)", store.url, store.max_turns, store.ttl)
+        return store
+
+    store = InMemorySessionStore()
+    logger.info("Session store: in-memory (max_turns=%s, token_budget=%s, ttl=%ss)", store.max_turns, store.token_budget, store.ttl)
+    return store
@@ -0,0 +1,69 @@
+# app/utils/adaptive_timeout.py
+import os
+import httpx
+from app.utils.latency_window import LatencyWindow
+
+# Per phase: (floor, ceiling) defaults in seconds
+DEFAULT_LIMITS = {
+    "connect": (0.5, 5.0),
+    "first_byte": (2.0, 15.0),
+    "total": (5.0, 20.0),
+}
+
+class AdaptiveTimeouts:
+    """Upstream timeouts derived from the latencies of recent successful calls.
+
+    Each phase's timeout is `multiplier` times the `quantile` of its latency
+    window, clamped to UPSTREAM_<PHASE>_TIMEOUT_MIN..MAX, and is the ceiling
+    until `min_samples` calls have been seen. A call slower than that is very
+    unlikely to succeed, so it is cut short and the slot freed.
+
+    - connect: TCP + TLS setup of new pooled connections, given to httpx as
+      its connect and pool timeouts
+    - first_byte: wall-clock limit on a streamed call up to its first token
+      frame, and the longest wait allowed between later token frames
+    - total: wall-clock limit on a non-streamed call up to the full reply
+
+    The first_byte and total limits are enforced around the whole attempt
+    (see `budget`) and per token frame, not as httpx read timeouts: DeepSeek
+    keeps slow requests alive with blank lines and `: keep-alive` comments,
+    which reset a read timeout on every byte.
+    """
+
+    def __init__(self, quantile=None, multiplier=None, min_samples=None):
+        self.quantile = quantile or float(os.getenv("UPSTREAM_TIMEOUT_QUANTILE", "0.99"))
+        self.multiplier = multiplier or float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "1.5"))
+        self.min_samples = min_samples or int(os.getenv("UPSTREAM_TIMEOUT_MIN_SAMPLES", "50"))
+        self.limits = {}
+        for phase, (floor, ceiling) in DEFAULT_LIMITS.items():
+            self.limits[phase] = (
+                float(os.getenv(f"UPSTREAM_{phase.upper()}_TIMEOUT_MIN", str(floor))),
+                float(os.getenv(f"UPSTREAM_{phase.upper()}_TIMEOUT_MAX", str(ceiling))),
+            )
+        self.windows = {phase: LatencyWindow() for phase in DEFAULT_LIMITS}
+
+    def observe(self, phase, seconds):
+        """Record the latency of a successful call (or connection setup)."""
+        self.windows[phase].observe(seconds)
+
+    def get(self, phase):
+        floor, ceiling = self.limits[phase]
+        window = self.windows[phase]
+        if len(window) < self.min_samples:
+            return ceiling
+        return min(ceiling, max(floor, self.multiplier * window.quantile(self.quantile)))
+
+    def budget(self, phase, remaining=None):
+        """Wall-clock seconds one attempt may take for `phase`, capped by the caller's remaining time."""
+        seconds = self.get(phase)
+        return seconds if remaining is None else min(seconds, remaining)
+
+    def for_attempt(self, remaining=None):
+        """httpx timeouts for one attempt: connect and pool only; reads are bounded by `budget`."""
+        connect = self.get("connect")
+        if remaining is not None:
+            connect = min(connect, remaining)
+        return httpx.Timeout(None, connect=connect, pool=connect)
+
+    def stats(self):
+        return {phase: round(self.get(phase), 3) for phase in self.limits}
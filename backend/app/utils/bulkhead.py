@@ -0,0 +1,104 @@
+# app/utils/bulkhead.py
+import asyncio
+import os
+import time
+from collections import deque
+from app.utils.logger import logger
+from app.utils.metrics import UPSTREAM_ADMISSION_REJECTIONS, UPSTREAM_QUEUE_WAIT
+
+class BulkheadFull(Exception):
+    """No upstream slot could be had in time; the request should be shed."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Upstream bulkhead full ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Slot:
+    """An admitted upstream slot; released once, on `release()` or leaving a `with` block."""
+
+    def __init__(self, bulkhead):
+        self.bulkhead = bulkhead
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.bulkhead._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class Bulkhead:
+    """Caps concurrent upstream calls, with a short FIFO queue in front.
+
+    Up to `max_concurrent` calls run at once. Further calls wait in a queue
+    of at most `max_queue` for up to `max_wait` seconds; a call that finds
+    the queue full, or is still waiting when its wait runs out, raises
+    BulkheadFull at once so the request can be shed with a 503 instead of
+    running into its deadline. A released slot is handed straight to the
+    oldest waiter.
+    """
+
+    def __init__(self, max_concurrent=None, max_queue=None, max_wait=None, retry_after=None):
+        self.max_concurrent = max_concurrent or int(os.getenv("UPSTREAM_MAX_CONCURRENT", "32"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("UPSTREAM_MAX_QUEUE", "64"))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("UPSTREAM_MAX_QUEUE_WAIT", "0.5"))
+        self.retry_after = retry_after or float(os.getenv("UPSTREAM_SHED_RETRY_AFTER", "1"))
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _reject(self, reason):
+        UPSTREAM_ADMISSION_REJECTIONS.inc(reason)
+        logger.warning("Shedding request: upstream bulkhead %s (%d active, %d queued)", reason, self.active, self.queued)
+        raise BulkheadFull(reason, self.retry_after)
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Hand the slot over; `active` stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    async def acquire(self, timeout=None):
+        """Wait for a slot (at most `max_wait`, or `timeout` if sooner) and return it as a Slot."""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            UPSTREAM_QUEUE_WAIT.observe(0.0)
+            return Slot(self)
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+
+        wait = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=wait)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self._release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            UPSTREAM_QUEUE_WAIT.observe(time.monotonic() - started)
+
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self._reject("timeout")
+        return Slot(self)
+
+    def stats(self):
+        return {"active": self.active, "queued": self.queued, "max_concurrent": self.max_concurrent}
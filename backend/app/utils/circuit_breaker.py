@@ -0,0 +1,155 @@
+# app/utils/circuit_breaker.py
+import os
+import time
+from collections import deque
+from typing import NamedTuple
+from app.utils.logger import logger
+from app.utils.metrics import CIRCUIT_CALLS, CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpen(Exception):
+    """The upstream circuit is open; the call was refused without being made."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open")
+        self.name = name
+        self.retry_after = retry_after
+
+class Permit(NamedTuple):
+    started: float
+    probe: bool
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a rolling window of call outcomes.
+
+    Outcomes are counted in one-second buckets covering the last
+    `window_seconds`. Once the window holds at least `min_calls` calls, the
+    circuit opens when the failure rate reaches `failure_rate` or the share of
+    calls slower than `slow_call_seconds` reaches `slow_call_rate`. While open,
+    calls are refused at once with CircuitOpen. After `open_seconds` the
+    circuit goes half-open and lets `half_open_probes` calls through: if they
+    all succeed in time it closes, and any failure or slow probe opens it again.
+
+    Callers take a Permit with `before_call` and report it with `after_call`,
+    passing failed=None when the call was abandoned (e.g. cancelled) and says
+    nothing about the upstream.
+    """
+
+    def __init__(self, name, window_seconds=None, min_calls=None, failure_rate=None,
+                 slow_call_seconds=None, slow_call_rate=None, open_seconds=None, half_open_probes=None):
+        self.name = name
+        self.window_seconds = window_seconds or int(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+        self.min_calls = min_calls or int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+        self.failure_rate = failure_rate or float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "8"))
+        self.slow_call_rate = slow_call_rate or float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+        self.open_seconds = open_seconds or float(os.getenv("CIRCUIT_OPEN_SECONDS", "15"))
+        self.half_open_probes = half_open_probes or int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "2"))
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        # [second, calls, failures, slow] per bucket, with running totals over the window
+        self._buckets = deque()
+        self._calls = self._failures = self._slow = 0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        CIRCUIT_STATE.set(1, self.name, CLOSED)
+
+    def _transition(self, state, now):
+        CIRCUIT_STATE.set(0, self.name, self.state)
+        CIRCUIT_STATE.set(1, self.name, state)
+        CIRCUIT_TRANSITIONS.inc(self.name, state)
+        logger.warning("Circuit '%s' %s -> %s", self.name, self.state, state)
+        self.state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self.opened_at = now
+        # Each closed period starts from a clean window
+        self._buckets.clear()
+        self._calls = self._failures = self._slow = 0
+
+    def _expire(self, now):
+        horizon = int(now) - self.window_seconds
+        while self._buckets and self._buckets[0][0] <= horizon:
+            _, calls, failures, slow = self._buckets.popleft()
+            self._calls -= calls
+            self._failures -= failures
+            self._slow -= slow
+
+    def _count(self, failed, slow, now):
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0, 0])
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        bucket[2] += failed
+        bucket[3] += slow
+        self._calls += 1
+        self._failures += failed
+        self._slow += slow
+        self._expire(now)
+
+    def before_call(self):
+        """Admit a call and return its Permit, or raise CircuitOpen."""
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, now)
+
+        if self.state == OPEN:
+            CIRCUIT_CALLS.inc(self.name, OPEN, "rejected")
+            raise CircuitOpen(self.name, self.opened_at + self.open_seconds - now)
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight + self._probe_successes >= self.half_open_probes:
+                CIRCUIT_CALLS.inc(self.name, HALF_OPEN, "rejected")
+                raise CircuitOpen(self.name, self.open_seconds)
+            self._probes_in_flight += 1
+            return Permit(now, True)
+        return Permit(now, False)
+
+    def after_call(self, permit, failed, duration=None):
+        """Report a call's outcome; `duration` defaults to the time since `before_call`."""
+        now = time.monotonic()
+        if duration is None:
+            duration = now - permit.started
+        slow = failed is False and duration >= self.slow_call_seconds
+        outcome = "abandoned" if failed is None else "failure" if failed else "slow" if slow else "success"
+
+        if permit.probe:
+            if self.state != HALF_OPEN:
+                return
+            CIRCUIT_CALLS.inc(self.name, HALF_OPEN, outcome)
+            self._probes_in_flight -= 1
+            if failed or slow:
+                self._transition(OPEN, now)
+            elif failed is False:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(CLOSED, now)
+            return
+
+        # Calls admitted before the circuit opened say nothing about the current state
+        if self.state != CLOSED or failed is None:
+            return
+        CIRCUIT_CALLS.inc(self.name, CLOSED, outcome)
+        self._count(failed, slow, now)
+        if self._calls >= self.min_calls and (
+            self._failures >= self.failure_rate * self._calls or self._slow >= self.slow_call_rate * self._calls
+        ):
+            logger.error(
+                "Circuit '%s' opening: %d of %d calls failed, %d slow in the last %ss",
+                self.name, self._failures, self._calls, self._slow, self.window_seconds
+            )
+            self._transition(OPEN, now)
+
+    def stats(self):
+        self._expire(time.monotonic())
+        return {
+            "state": self.state,
+            "window_calls": self._calls,
+            "window_failures": self._failures,
+            "window_slow": self._slow,
+        }
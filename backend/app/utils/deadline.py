@@ -0,0 +1,24 @@
+# app/utils/deadline.py
+import time
+
+class Deadline:
+    """Overall request deadline that each pipeline stage draws its timeout from."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + timeout
+
+    def remaining(self):
+        """Seconds left before the deadline, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def stage_timeout(self, budget):
+        """Timeout for one stage: its own budget, capped by what is left overall."""
+        return min(budget, self.remaining())
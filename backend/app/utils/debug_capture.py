@@ -0,0 +1,85 @@
+# app/utils/debug_capture.py
+import os
+import random
+import time
+from collections import deque
+from app.utils import log_context
+
+class DebugCapture:
+    """Full upstream request/response pairs for a sample of traffic, on demand.
+
+    A call is captured when its session is flagged (DEBUG_CAPTURE_SESSIONS or
+    `flag`) or it falls in the DEBUG_CAPTURE_SAMPLE_RATE fraction. Entries keep
+    the payload and response as the objects already in hand (nothing is
+    serialized on the request path) in a ring buffer of DEBUG_CAPTURE_MAX
+    entries. Calls that are not captured cost one set lookup and, with a
+    non-zero rate, one random draw.
+    """
+
+    def __init__(self, sample_rate=None, sessions=None, max_entries=None):
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("DEBUG_CAPTURE_SAMPLE_RATE", "0"))
+        if sessions is None:
+            sessions = os.getenv("DEBUG_CAPTURE_SESSIONS", "").split(",")
+        self.flagged_sessions = {session_id.strip() for session_id in sessions if session_id.strip()}
+        self._entries = deque(maxlen=max_entries or int(os.getenv("DEBUG_CAPTURE_MAX", "200")))
+        self.captured = 0
+
+    def flag(self, session_id):
+        self.flagged_sessions.add(session_id)
+
+    def unflag(self, session_id):
+        self.flagged_sessions.discard(session_id)
+
+    def begin(self, payload, stream=False):
+        """Start an entry for this upstream call, or return None if it is not captured."""
+        scope = log_context.current_request() or {}
+        session_id = scope.get("session_id")
+        if session_id not in self.flagged_sessions and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return None
+
+        entry = {
+            "timestamp": time.time(),
+            "request_id": scope.get("request_id"),
+            "session_id": session_id,
+            "stream": stream,
+            "request": payload,
+            "status": None,
+            "headers": None,
+            "response": None,
+            "error": None,
+            "duration_ms": None,
+        }
+        # Appended up front so calls still in flight show up too
+        self._entries.append(entry)
+        self.captured += 1
+        entry["_started"] = time.perf_counter()
+        return entry
+
+    def finish(self, entry, status=None, headers=None, response=None, error=None):
+        if entry is None:
+            return
+        started = entry.pop("_started", None)
+        if started is None:
+            # Already finished with the response; just note the later failure
+            entry["error"] = error
+            return
+        entry.update(status=status, headers=headers, response=response, error=error)
+        entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def entries(self, session_id=None, limit=50):
+        """Most recent entries first, optionally for one session."""
+        found = []
+        for entry in reversed(self._entries):
+            if session_id is None or entry["session_id"] == session_id:
+                found.append({key: value for key, value in entry.items() if not key.startswith("_")})
+                if len(found) >= limit:
+                    break
+        return found
+
+    def stats(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "flagged_sessions": len(self.flagged_sessions),
+            "buffered": len(self._entries),
+            "captured": self.captured,
+        }
@@ -0,0 +1,109 @@
+# app/utils/hedging.py
+import asyncio
+import os
+import time
+from app.utils.latency_window import LatencyWindow
+from app.utils.logger import logger
+from app.utils.metrics import HEDGE_LATENCY, HEDGES
+from app.utils.retry import RetryBudget
+
+class Hedger:
+    """Hedged upstream calls: a second attempt when the first is slower than usual.
+
+    When the first attempt has produced nothing after the `quantile` of recent
+    successful first-attempt latencies (clamped to `min_delay`..`max_delay`,
+    and only once `min_samples` are known), a second identical attempt is
+    started and whichever returns first wins; the other is cancelled, or closed if it also
+    finished. Hedges are limited to `max_rate` of calls by a budget, which
+    bounds the extra upstream spend (a cancelled attempt may still be billed
+    for its prompt). Disabled unless UPSTREAM_HEDGING=true.
+
+    HEDGE_LATENCY records each call's first-attempt latency (the time it had
+    run when cancelled, if it lost) next to the latency the caller saw, so the
+    tail improvement shows up as the gap between the two.
+    """
+
+    def __init__(self, enabled=None, quantile=None, max_rate=None, min_delay=None, max_delay=None, min_samples=20):
+        self.enabled = enabled if enabled is not None else os.getenv("UPSTREAM_HEDGING", "false").lower() == "true"
+        self.quantile = quantile or float(os.getenv("UPSTREAM_HEDGE_QUANTILE", "0.9"))
+        self.min_delay = min_delay or float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.5"))
+        self.max_delay = max_delay or float(os.getenv("UPSTREAM_HEDGE_MAX_DELAY", "10"))
+        self.min_samples = min_samples
+        self.latencies = LatencyWindow()
+        self.budget = RetryBudget(
+            max_rate if max_rate is not None else float(os.getenv("UPSTREAM_HEDGE_MAX_RATE", "0.05")), 0
+        )
+
+    def delay(self):
+        """Seconds to wait for the first attempt before hedging, or None to not hedge."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return min(self.max_delay, max(self.min_delay, self.latencies.quantile(self.quantile)))
+
+    async def _discard(self, task):
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            await task.result().aclose()
+
+    def _succeeded(self, task):
+        return (
+            task.done() and not task.cancelled() and task.exception() is None
+            and task.result().status_code == 200
+        )
+
+    async def run(self, attempt, timeout=None):
+        """Call `attempt(timeout)` (returning an httpx response), hedging it if it is slow."""
+        if not self.enabled:
+            return await attempt(timeout)
+
+        self.budget.deposit()
+        started = time.monotonic()
+        primary = asyncio.create_task(attempt(timeout))
+        tasks = [primary]
+        pending = {primary}
+        winner = None
+        primary_latency = None
+        try:
+            delay = self.delay()
+            if delay is not None and (timeout is None or delay < timeout):
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    if self.budget.withdraw():
+                        HEDGES.inc("fired")
+                        logger.info("Upstream slower than %.2fs, sending a hedged request", delay)
+                        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+                        tasks.append(asyncio.create_task(attempt(remaining)))
+                        pending.add(tasks[-1])
+                    else:
+                        HEDGES.inc("skipped")
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if primary in done:
+                    primary_latency = time.monotonic() - started
+                # Prefer an attempt that succeeded; a failed one only wins if it is the last
+                for task in done:
+                    if winner is None or (winner.exception() is not None and task.exception() is None):
+                        winner = task
+                if winner.exception() is None:
+                    break
+                if pending:
+                    await self._discard(winner)
+                    winner = None
+        finally:
+            elapsed = time.monotonic() - started
+            for task in tasks:
+                if task is not winner:
+                    await self._discard(task)
+            if winner is not None and winner is not primary and winner.exception() is None:
+                HEDGES.inc("won")
+            if primary_latency is None:
+                primary_latency = elapsed
+            # Only successful calls set the hedge delay, as for AdaptiveTimeouts;
+            # fast errors and 429s would pull it down and fire needless hedges
+            if self._succeeded(primary):
+                self.latencies.observe(primary_latency)
+            HEDGE_LATENCY.observe(primary_latency, "primary")
+            HEDGE_LATENCY.observe(elapsed, "effective")
+        return winner.result()
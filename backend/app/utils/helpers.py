@@ -1,12 +1,120 @@
-from langdetect import detect, LangDetectException
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from langdetect import DetectorFactory, detect, LangDetectException
+from langdetect.detector_factory import init_factory
+
+# langdetect is randomized unless seeded; a fixed seed makes results repeatable
+DetectorFactory.seed = 0
+
+# Only the first characters are analyzed; language rarely changes mid-message
+LANGUAGE_SAMPLE_CHARS = int(os.getenv("LANGUAGE_SAMPLE_CHARS", "200"))
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", "4096"))
+
+# Only words that are not also common Spanish, French, Italian, German, Dutch or
+# Portuguese words ("no", "me", "a", "in", "so", "was" are all ambiguous)
+ENGLISH_STOPWORDS = frozenset(
+    "about and are because been but cant could does doesnt dont from have how im "
+    "its ive just like not really should that the their there they this what "
+    "when why will with would you youre your".split()
+)
+# Share of words that must be English stopwords for the fast path
+ENGLISH_STOPWORD_RATIO = 0.2
+
+# Unicode ranges whose script identifies a single language on its own
+SCRIPT_LANGUAGES = (
+    (0x3040, 0x30FF, "ja"),  # Hiragana, Katakana
+    (0xAC00, 0xD7AF, "ko"),  # Hangul syllables
+    (0x1100, 0x11FF, "ko"),  # Hangul jamo
+    (0x0E00, 0x0E7F, "th"),  # Thai
+    (0x0370, 0x03FF, "el"),  # Greek
+    (0x0590, 0x05FF, "he"),  # Hebrew
+    (0x10A0, 0x10FF, "ka"),  # Georgian
+    (0x0530, 0x058F, "hy"),  # Armenian
+)
+
+_WORD = re.compile(r"[a-z']+")
+_language_cache = OrderedDict()
+_language_cache_lock = threading.Lock()
+
+def preload_language_profiles():
+    """Load langdetect's language profiles up front so no request pays the warm-up."""
+    init_factory()
+
+def _script_language(sample):
+    """Return the language implied by the script of most of the letters, if any."""
+    letters = 0
+    counts = {}
+    for char in sample:
+        if not char.isalpha():
+            continue
+        letters += 1
+        code = ord(char)
+        if code < 0x0370:
+            continue
+        for low, high, language in SCRIPT_LANGUAGES:
+            if low <= code <= high:
+                counts[language] = counts.get(language, 0) + 1
+                break
+    for language, count in counts.items():
+        if count * 2 >= letters:
+            return language
+    return None
+
+def _looks_english(words):
+    """Pure-ASCII words of which enough are unambiguous English stopwords."""
+    stopwords = sum(1 for word in words if word.replace("'", "") in ENGLISH_STOPWORDS)
+    return stopwords / len(words) >= ENGLISH_STOPWORD_RATIO
+
+def _detect_uncached(sample, words):
+    if sample.isascii() and _looks_english(words):
+        return "en"
+
+    language = _script_language(sample)
+    if language:
+        return language
 
-def detect_language(text):
-    """Detect the language of a text."""
     try:
-        return detect(text)
+        return detect(sample)
     except LangDetectException:
         return "en"  # Default to English
 
+def detect_language(text):
+    """Detect the language of a text.
+
+    Obvious cases (English stopwords, single-language scripts) are answered
+    without langdetect, only a fixed prefix is analyzed, and results are cached
+    by content hash in a bounded LRU.
+    """
+    sample = text.strip()[:LANGUAGE_SAMPLE_CHARS]
+    if not sample:
+        return "en"
+    words = _WORD.findall(sample.lower())
+    if len(words) <= 2 and sample.isascii():
+        # "lol ok", "hola amigo": too short to tell, so the default, and not cached as a result
+        return "en"
+
+    key = hashlib.blake2b(sample.encode("utf-8"), digest_size=8).digest()
+    with _language_cache_lock:
+        language = _language_cache.get(key)
+        if language is not None:
+            _language_cache.move_to_end(key)
+            return language
+
+    language = _detect_uncached(sample, words)
+
+    with _language_cache_lock:
+        _language_cache[key] = language
+        if len(_language_cache) > LANGUAGE_CACHE_SIZE:
+            _language_cache.popitem(last=False)
+    return language
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token plus per-message overhead)."""
+    return len(text) // 4 + 4
+
 def safe_get(data, keys, default=None):
     """Safely get nested dictionary values."""
     if not data:
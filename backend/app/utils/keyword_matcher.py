@@ -0,0 +1,145 @@
+# app/utils/keyword_matcher.py
+import re
+from typing import NamedTuple
+
+# Use the C Aho-Corasick automaton when it is installed, fall back to a tokenizing scan
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Characters that may separate the words of a multi-word phrase, and apostrophe spellings
+PHRASE_SEPARATORS = (" ", "-")
+APOSTROPHES = ("'", "’")
+
+_TOKEN = re.compile(r"\w+")
+
+class KeywordHit(NamedTuple):
+    label: str
+    keyword: str
+    start: int
+    end: int
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+def _spellings(keyword):
+    """Expand a lexicon phrase into the surface spellings the matcher accepts."""
+    spellings = [keyword]
+    if " " in keyword:
+        spellings = [s.replace(" ", sep) for s in spellings for sep in PHRASE_SEPARATORS]
+    if "'" in keyword:
+        spellings = [s.replace("'", apostrophe) for s in spellings for apostrophe in APOSTROPHES]
+    return spellings
+
+class KeywordMatcher:
+    """Token-aware matcher for a labeled keyword lexicon.
+
+    Keywords only match on word boundaries, so "sex" no longer fires inside
+    "Essex" and "sti" no longer fires inside "still". A trailing `*` turns a
+    keyword into a prefix (`stress*` matches "stressed", "stressful"), and
+    multi-word phrases also match with hyphens (`self harm` -> "self-harm").
+
+    The lexicon is compiled once into an Aho-Corasick automaton (pyahocorasick)
+    or, when that is not installed, into a first-token index used by a
+    tokenizing scan; either way the message is lower-cased once and walked once
+    for all labels.
+    """
+
+    def __init__(self, lexicon):
+        # lexicon: {label: [keyword, ...]}, label order is preserved in results
+        self.labels = list(lexicon)
+        self._labels_by_keyword = {}
+        self._prefix_keywords = set()
+        spellings = {}
+        for label, keywords in lexicon.items():
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if keyword.endswith("*"):
+                    keyword = keyword[:-1]
+                    self._prefix_keywords.add(keyword)
+                self._labels_by_keyword.setdefault(keyword, []).append(label)
+                for spelling in _spellings(keyword):
+                    spellings[spelling] = keyword
+
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for spelling, keyword in spellings.items():
+                self._automaton.add_word(spelling, (keyword, len(spelling)))
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            self._build_token_index(spellings)
+
+    def _build_token_index(self, spellings):
+        """Index spellings by their first token for the pure-Python tokenizing fallback."""
+        self._exact = {}
+        self._prefixes = {}
+        self._phrases = {}
+        for spelling, keyword in spellings.items():
+            first_token = _TOKEN.match(spelling).group()
+            if first_token != spelling:
+                self._phrases.setdefault(first_token, []).append((spelling, keyword))
+            elif keyword in self._prefix_keywords:
+                self._prefixes[spelling] = keyword
+            else:
+                self._exact[spelling] = keyword
+        for candidates in self._phrases.values():
+            candidates.sort(key=lambda candidate: len(candidate[0]), reverse=True)
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes}, reverse=True)
+
+    @property
+    def backend(self):
+        return "aho-corasick" if self._automaton is not None else "tokens"
+
+    def _matches(self, text):
+        """Yield (keyword, start, end) for every whole-token keyword in lower-cased text."""
+        length = len(text)
+        if self._automaton is not None:
+            for last, (keyword, size) in self._automaton.iter(text):
+                start = last - size + 1
+                end = last + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if keyword in self._prefix_keywords:
+                    end = self._token_end(text, end, length)
+                elif end < length and _is_word_char(text[end]):
+                    continue
+                yield keyword, start, end
+            return
+
+        for token in _TOKEN.finditer(text):
+            word = token.group()
+            start = token.start()
+            for spelling, keyword in self._phrases.get(word, ()):
+                end = start + len(spelling)
+                if text.startswith(spelling, start):
+                    if keyword in self._prefix_keywords:
+                        yield keyword, start, self._token_end(text, end, length)
+                    elif end >= length or not _is_word_char(text[end]):
+                        yield keyword, start, end
+            if word in self._exact:
+                yield self._exact[word], start, token.end()
+                continue
+            for size in self._prefix_lengths:
+                if size <= len(word) and word[:size] in self._prefixes:
+                    yield self._prefixes[word[:size]], start, token.end()
+                    break
+
+    @staticmethod
+    def _token_end(text, end, length):
+        while end < length and _is_word_char(text[end]):
+            end += 1
+        return end
+
+    def finditer(self, text):
+        """Yield a KeywordHit for every keyword occurrence in text."""
+        for keyword, start, end in self._matches(text.lower()):
+            for label in self._labels_by_keyword[keyword]:
+                yield KeywordHit(label, keyword, start, end)
+
+    def scan(self, text):
+        """Return (matched labels in lexicon order, list of hits)."""
+        hits = list(self.finditer(text))
+        found = {hit.label for hit in hits}
+        return [label for label in self.labels if label in found], hits
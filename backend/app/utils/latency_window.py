@@ -0,0 +1,31 @@
+# app/utils/latency_window.py
+from collections import deque
+
+class LatencyWindow:
+    """The last `size` latency samples, with quantiles recomputed every `refresh` samples.
+
+    Quantiles are read on every upstream call but only change slowly, so the
+    sort of the window is amortised over `refresh` observations.
+    """
+
+    def __init__(self, size=500, refresh=20):
+        self._samples = deque(maxlen=size)
+        self.refresh = refresh
+        self._sorted = []
+        self._since_refresh = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh or len(self._samples) <= self.refresh:
+            self._sorted = sorted(self._samples)
+            self._since_refresh = 0
+
+    def quantile(self, q):
+        """The q-quantile (0..1) of the window, or None while it is empty."""
+        if not self._sorted:
+            return None
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
@@ -0,0 +1,75 @@
+# app/utils/log_context.py
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.utils.metrics import STAGE_LATENCY
+
+# Per-request fields (request_id, session_id, timings); one mutable dict shared by
+# every task the request spawns, so stage timings recorded in a child task are seen
+_request = ContextVar("log_request", default=None)
+# Current stage; a separate var so concurrent stages in sibling tasks don't clash
+_stage = ContextVar("log_stage", default=None)
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+def new_request_id(inbound=None):
+    """Use a well-formed inbound X-Request-ID (e.g. from the ALB), else a random one."""
+    if inbound and _REQUEST_ID_PATTERN.match(inbound):
+        return inbound
+    return uuid.uuid4().hex
+
+def begin_request(request_id):
+    """Start a request scope; returns a token for `end_request`."""
+    return _request.set({"request_id": request_id, "timings": {}})
+
+def end_request(token):
+    _request.reset(token)
+
+def current_request():
+    """The request scope dict, or None outside a request."""
+    return _request.get()
+
+def bind(**fields):
+    """Attach fields (e.g. session_id) to every later log record of this request."""
+    scope = _request.get()
+    if scope is not None:
+        scope.update(fields)
+
+def record_timing(name, seconds):
+    """Add a span's duration to the request timings and the stage latency histogram.
+
+    Request timings feed the Server-Timing header and the slow-request log;
+    repeated spans with the same name (e.g. upstream retries) add up.
+    """
+    STAGE_LATENCY.observe(seconds, name)
+    scope = _request.get()
+    if scope is not None:
+        timings = scope["timings"]
+        timings[name] = round(timings.get(name, 0) + seconds * 1000, 2)
+
+def server_timing(timings, total_ms=None):
+    """Format request timings (milliseconds) as a Server-Timing header value."""
+    entries = [f"{name};dur={ms}" for name, ms in timings.items()]
+    if total_ms is not None:
+        entries.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(entries)
+
+def current_stage():
+    return _stage.get()
+
+@contextmanager
+def stage(name):
+    """A span: tag log records inside the block with `name` and time it.
+
+    The duration goes to `record_timing`, so one `with stage(...)` shows up in
+    the Server-Timing header, the slow-request log and the metrics registry.
+    """
+    token = _stage.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - started)
+        _stage.reset(token)
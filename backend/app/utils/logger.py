@@ -1,36 +1,290 @@
 # app/utils/logger.py
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
 import os
-from datetime import datetime
+import threading
+import zlib
+from datetime import datetime, timezone
+from app.utils import log_context
+
+# Attributes every LogRecord has; anything else on a record came in through `extra`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "context", "always_log"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, the request
+    context (request_id, session_id, stage) and any `extra` fields."""
+
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        context = getattr(record, "context", None)
+        if context:
+            event.update(context)
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                event[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event["exception"] = record.exc_text
+        return json.dumps(event, default=str, ensure_ascii=False)
+
+class ContextTextFormatter(logging.Formatter):
+    """The plain text format, with the request id appended when there is one."""
+
+    def format(self, record):
+        line = super().format(record)
+        context = getattr(record, "context", None)
+        if context and "request_id" in context:
+            line += f" [request_id={context['request_id']}]"
+        return line
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records per level, e.g. LOG_SAMPLE_RATES="INFO=0.1".
+
+    Inside a request the decision is made from the request id, so a sampled
+    request keeps all of its lines and an unsampled one drops them together.
+    Records logged with extra={"always_log": True} are never sampled out.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    @classmethod
+    def from_spec(cls, spec):
+        rates = {}
+        for item in spec.split(","):
+            if "=" in item:
+                level, rate = item.split("=", 1)
+                rates[logging.getLevelName(level.strip().upper())] = float(rate)
+        return cls(rates)
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or getattr(record, "always_log", False):
+            return True
+        scope = log_context.current_request()
+        if scope is not None:
+            return zlib.crc32(scope["request_id"].encode()) / 0xFFFFFFFF < rate
+        return random.random() < rate
+
+class BatchStreamHandler(logging.StreamHandler):
+    """StreamHandler that writes without flushing; the listener flushes once per batch."""
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+class BatchFileHandler(logging.FileHandler):
+    """FileHandler that writes without flushing; the listener flushes once per batch."""
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread through a bounded queue.
+
+    The calling thread (usually the event loop) only snapshots the request
+    context and enqueues; the message is formatted on the listener thread, so
+    pass %-style args (immutable values) rather than building f-strings. When
+    the queue is full the drop policy decides what is lost:
+
+    - "drop_new": discard the incoming record, except WARNING and above, which
+      evict the oldest queued record instead
+    - "drop_oldest": evict the oldest queued record
+    - "block": wait up to `block_timeout` seconds for room, then drop the record
+
+    Every lost record is counted in `dropped`.
+    """
+
+    POLICIES = ("drop_new", "drop_oldest", "block")
+
+    def __init__(self, log_queue, policy="drop_new", block_timeout=0.05):
+        super().__init__(log_queue)
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown LOG_DROP_POLICY '{policy}', expected one of {self.POLICIES}")
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+
+    def prepare(self, record):
+        # The listener thread cannot see this task's contextvars, so copy them now
+        scope = log_context.current_request()
+        stage = log_context.current_stage()
+        if scope is not None or stage is not None:
+            context = {key: value for key, value in (scope or {}).items() if key != "timings"}
+            if stage is not None:
+                context["stage"] = stage
+            record.context = context
+        return record
+
+    def _count_drop(self):
+        with self._drop_lock:
+            self.dropped += 1
+
+    def _evict_oldest(self, record):
+        try:
+            self.queue.get_nowait()
+            self._count_drop()
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._count_drop()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == "block":
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+            except queue.Full:
+                self._count_drop()
+        elif self.policy == "drop_oldest" or record.levelno >= logging.WARNING:
+            self._evict_oldest(record)
+        else:
+            self._count_drop()
+
+class BatchQueueListener(logging.handlers.QueueListener):
+    """QueueListener that drains up to `batch_size` records per wakeup and
+    flushes each handler once per batch instead of once per record.
+
+    After a batch in which records were dropped it writes one WARNING with the
+    number lost, so gaps in the log are visible.
+    """
+
+    def __init__(self, log_queue, *handlers, batch_size=256):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.queue_handler = None
+        self._reported_drops = 0
+
+    def enqueue_sentinel(self):
+        # The queue may be full at shutdown; wait for room rather than lose the stop signal
+        self.queue.put(self._sentinel)
+
+    def _report_drops(self):
+        dropped = self.queue_handler.dropped if self.queue_handler is not None else 0
+        if dropped == self._reported_drops:
+            return
+        record = logging.LogRecord(
+            "talk2me", logging.WARNING, __file__, 0,
+            f"Log queue full, dropped {dropped - self._reported_drops} records ({dropped} total)", None, None
+        )
+        self._reported_drops = dropped
+        self.handle(record)
+
+    def _monitor(self):
+        log_queue = self.queue
+        while True:
+            batch = [log_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                    continue
+                self.handle(record)
+            self._report_drops()
+            for handler in self.handlers:
+                handler.flush()
+            for _ in batch:
+                log_queue.task_done()
+
+            if stop:
+                return
 
 def setup_logger():
-    """Configure and return a logger for the application."""
+    """Configure and return a logger for the application.
+
+    Records go through a bounded in-memory queue to a background thread that
+    writes and flushes them in batches, so logging never does blocking I/O on
+    the event loop. Tuned with LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_DROP_POLICY
+    and LOG_QUEUE_BLOCK_TIMEOUT. LOG_FORMAT picks "json" (default) or "text";
+    LOG_SAMPLE_RATES sets per-level sampling.
+    """
     logger = logging.getLogger("talk2me")
     logger.setLevel(logging.INFO)
-    
+
     # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler = BatchStreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
-    
+
     # Create logs directory if it doesn't exist
     logs_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "logs")
     os.makedirs(logs_dir, exist_ok=True)
-    
+
     # File handler for more permanent logging
     log_file_path = os.path.join(logs_dir, f"talk2me_{datetime.now().strftime('%Y%m%d')}.log")
-    file_handler = logging.FileHandler(log_file_path)
+    file_handler = BatchFileHandler(log_file_path)
     file_handler.setLevel(logging.INFO)
-    
+
     # Format
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if os.getenv("LOG_FORMAT", "json").lower() == "text":
+        formatter = ContextTextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    else:
+        formatter = JsonFormatter()
     console_handler.setFormatter(formatter)
     file_handler.setFormatter(formatter)
-    
+
+    # Both handlers sit behind the queue; the logger itself only enqueues
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = BoundedQueueHandler(
+        log_queue,
+        policy=os.getenv("LOG_DROP_POLICY", "drop_new").lower(),
+        block_timeout=float(os.getenv("LOG_QUEUE_BLOCK_TIMEOUT", "0.05"))
+    )
+    listener = BatchQueueListener(
+        log_queue, console_handler, file_handler,
+        batch_size=int(os.getenv("LOG_BATCH_SIZE", "256"))
+    )
+    listener.queue_handler = queue_handler
+    listener.start()
+    # Drain whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
     # Add handlers
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
-    
-    return logger
+    logger.addHandler(queue_handler)
+    sample_rates = os.getenv("LOG_SAMPLE_RATES", "")
+    if sample_rates:
+        logger.addFilter(SamplingFilter.from_spec(sample_rates))
+
+    return logger, queue_handler
+
+def log_stats():
+    """Queue depth and dropped-record count for the health and metrics surfaces."""
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "policy": _queue_handler.policy,
+    }
 
-logger = setup_logger()
\ No newline at end of file
+logger, _queue_handler = setup_logger()
\ No newline at end of file
@@ -0,0 +1,251 @@
+# app/utils/metrics.py
+import asyncio
+import glob
+import json
+import os
+import time
+from bisect import bisect_left
+
+# Seconds; spans in-process stages (sub-millisecond) through slow upstream calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0)
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def snapshot(self):
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        # Single dict read-modify-write on the event loop thread; no lock needed
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+class CallbackGauge(_Metric):
+    """Gauge read from `collect()` (returning {labels tuple: value}) at snapshot time."""
+
+    type = "gauge"
+
+    def __init__(self, name, help_text, labelnames, collect):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+
+    def snapshot(self):
+        try:
+            values = self.collect()
+        except Exception:
+            return []
+        return [[list(labels), value] for labels, value in values.items()]
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # Per-bucket counts (not cumulative; the last slot is +Inf), then sum
+            state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def snapshot(self):
+        return [[list(labels), list(state)] for labels, state in self._values.items()]
+
+class MetricsRegistry:
+    """In-process metrics with Prometheus text exposition.
+
+    Recording is a dict update on the event loop thread. With several uvicorn
+    workers, set METRICS_DIR to a directory shared by them: every worker
+    writes its snapshot there every METRICS_FLUSH_INTERVAL seconds (atomic
+    replace), and whichever worker serves /metrics merges all snapshots with
+    its own live values. Counters and histograms of workers that have exited
+    keep counting; their gauges are dropped once the snapshot is stale.
+    """
+
+    def __init__(self, directory=None, flush_interval=None):
+        self.directory = directory if directory is not None else os.getenv("METRICS_DIR", "")
+        self.flush_interval = flush_interval or float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+        self._metrics = {}
+        self._flusher = None
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def gauge_callback(self, name, help_text, labelnames, collect):
+        return self._register(CallbackGauge(name, help_text, labelnames, collect))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def snapshot(self):
+        metrics = {}
+        for name, metric in self._metrics.items():
+            metrics[name] = {
+                "type": metric.type,
+                "help": metric.help,
+                "labelnames": metric.labelnames,
+                "buckets": getattr(metric, "buckets", None),
+                "values": metric.snapshot(),
+            }
+        return {"pid": os.getpid(), "timestamp": time.time(), "metrics": metrics}
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f"worker-{pid}.json")
+
+    def flush(self, snapshot=None):
+        """Write this worker's snapshot for the others to merge."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot or self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # Snapshot on the loop thread, write in a worker thread
+                await asyncio.to_thread(self.flush, self.snapshot())
+            except OSError:
+                pass
+
+    def start(self):
+        if self.directory and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await asyncio.to_thread(self.flush, self.snapshot())
+
+    def _collect_snapshots(self, own):
+        snapshots = [own]
+        if self.directory:
+            own_path = self._snapshot_path(own["pid"])
+            for path in glob.glob(os.path.join(self.directory, "worker-*.json")):
+                if path == own_path:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+    def merged(self, own=None):
+        """Sum every worker's snapshot into {name: (spec, {labels: value})}."""
+        stale_before = time.time() - 3 * self.flush_interval
+        merged = {}
+        for snapshot in self._collect_snapshots(own or self.snapshot()):
+            stale = snapshot["timestamp"] < stale_before
+            for name, spec in snapshot["metrics"].items():
+                if stale and spec["type"] == "gauge":
+                    continue
+                _, values = merged.setdefault(name, (spec, {}))
+                for labels, value in spec["values"]:
+                    key = tuple(labels)
+                    if spec["type"] == "histogram":
+                        current = values.get(key)
+                        values[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                    else:
+                        values[key] = values.get(key, 0) + value
+        return merged
+
+    def render(self, own=None):
+        """Prometheus text exposition format (version 0.0.4).
+
+        Take `own` with `snapshot()` on the event loop thread when rendering in
+        a worker thread, so live values are never iterated concurrently.
+        """
+        lines = []
+        for name, (spec, values) in sorted(self.merged(own).items()):
+            lines.append(f"# HELP {name} {spec['help']}")
+            lines.append(f"# TYPE {name} {spec['type']}")
+            labelnames = spec["labelnames"]
+            for labels, value in sorted(values.items()):
+                pairs = [f'{key}="{_escape(val)}"' for key, val in zip(labelnames, labels)]
+                if spec["type"] != "histogram":
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip([*spec["buckets"], "+Inf"], value[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    bucket_pairs = pairs + [f'le="{le}"']
+                    lines.append(f"{name}_bucket{_labels(bucket_pairs)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    "talk2me_http_request_duration_seconds", "HTTP request latency to the last body byte", ("route", "method", "status")
+)
+REQUESTS_IN_FLIGHT = registry.gauge("talk2me_http_requests_in_flight", "HTTP requests currently being served")
+STAGE_LATENCY = registry.histogram("talk2me_stage_duration_seconds", "Chat pipeline stage latency", ("stage",))
+UPSTREAM_RESPONSES = registry.counter("talk2me_upstream_responses_total", "DeepSeek responses by HTTP status", ("status",))
+UPSTREAM_ERRORS = registry.counter("talk2me_upstream_errors_total", "DeepSeek calls that failed without a response", ("kind",))
+UPSTREAM_RETRIES = registry.counter("talk2me_upstream_retries_total", "DeepSeek calls retried", ("reason",))
+UPSTREAM_RETRIES_SKIPPED = registry.counter(
+    "talk2me_upstream_retries_skipped_total", "Retryable DeepSeek failures not retried", ("reason",)
+)
+TOKENS_USED = registry.counter("talk2me_tokens_total", "LLM tokens reported by DeepSeek usage blocks", ("kind",))
+RATE_LIMIT_REJECTIONS = registry.counter("talk2me_rate_limit_rejections_total", "Requests rejected by a rate limit", ("limit",))
+TOKEN_QUOTA_REJECTIONS = registry.counter("talk2me_token_quota_rejections_total", "Chat turns refused by a token quota", ("scope",))
+CIRCUIT_STATE = registry.gauge("talk2me_circuit_state", "1 for the current state of each circuit breaker", ("circuit", "state"))
+CIRCUIT_TRANSITIONS = registry.counter("talk2me_circuit_transitions_total", "Circuit breaker state changes", ("circuit", "state"))
+CIRCUIT_CALLS = registry.counter(
+    "talk2me_circuit_calls_total", "Calls through a circuit breaker by state and outcome", ("circuit", "state", "outcome")
+)
+HEDGES = registry.counter("talk2me_upstream_hedges_total", "Hedged DeepSeek requests: fired, won, or skipped by the budget", ("outcome",))
+HEDGE_LATENCY = registry.histogram(
+    "talk2me_upstream_hedged_call_seconds", "First-attempt vs effective latency of hedged-mode DeepSeek calls", ("attempt",)
+)
+UPSTREAM_QUEUE_WAIT = registry.histogram("talk2me_upstream_queue_wait_seconds", "Time chat turns waited for an upstream slot")
+UPSTREAM_ADMISSION_REJECTIONS = registry.counter(
+    "talk2me_upstream_admission_rejections_total", "Chat turns shed because no upstream slot was free in time", ("reason",)
+)
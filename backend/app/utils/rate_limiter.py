@@ -1,29 +1,335 @@
 # app/utils/rate_limiter.py
+import asyncio
+import ipaddress
+import math
+import os
 import time
-from collections import defaultdict
-from fastapi import HTTPException, Request, status
+from collections import OrderedDict
+from app.utils.logger import logger
+from app.utils.metrics import RATE_LIMIT_REJECTIONS
+
+# Shared limiting is optional; only needed when RATE_LIMIT_BACKEND=redis
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
 
 class RateLimiter:
-    def __init__(self, requests_per_minute=60):
+    """GCRA rate limiter: one float (theoretical arrival time) per client.
+
+    A client may burst up to `burst` requests (default: a full minute's worth)
+    and is then held to `requests_per_minute`. Keys are kept in least-recently
+    seen order; each call sweeps a couple of idle keys off the front, so memory
+    stays bounded by the set of clients active within the last period.
+    """
+
+    def __init__(self, requests_per_minute=60, burst=None, max_keys=100_000, sweep_per_call=2):
         self.requests_per_minute = requests_per_minute
-        self.requests = defaultdict(list)
-    
-    async def __call__(self, request: Request):
-        client_ip = request.client.host
-        current_time = time.time()
-        
-        # Remove requests older than 1 minute
-        self.requests[client_ip] = [req_time for req_time in self.requests[client_ip] 
-                                   if current_time - req_time < 60]
-        
-        # Check if client has exceeded rate limit
-        if len(self.requests[client_ip]) >= self.requests_per_minute:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded. Please try again later."
+        self.burst = burst or requests_per_minute
+        self.emission_interval = 60.0 / requests_per_minute
+        self.period = self.emission_interval * self.burst
+        self.max_keys = max_keys
+        self.sweep_per_call = sweep_per_call
+        self._tat = OrderedDict()
+
+    @property
+    def size(self):
+        """Number of client keys currently tracked."""
+        return len(self._tat)
+
+    def sweep(self, now):
+        # A key whose TAT has passed is indistinguishable from a fresh client
+        for _ in range(self.sweep_per_call):
+            if not self._tat:
+                return
+            _, tat = next(iter(self._tat.items()))
+            if tat > now and len(self._tat) <= self.max_keys:
+                return
+            self._tat.popitem(last=False)
+
+    def check(self, key, now):
+        """Return (allowed, retry_after_seconds, new_tat) without recording anything."""
+        tat = max(self._tat.get(key, now), now)
+        new_tat = tat + self.emission_interval
+        if new_tat - now > self.period:
+            return False, new_tat - self.period - now, tat
+        return True, 0.0, new_tat
+
+    def commit(self, key, new_tat):
+        self._tat[key] = new_tat
+        self._tat.move_to_end(key)
+
+    def hit(self, key, now=None):
+        """Record one request for key; return (allowed, retry_after_seconds)."""
+        now = time.monotonic() if now is None else now
+        self.sweep(now)
+
+        allowed, retry_after, new_tat = self.check(key, now)
+        if allowed:
+            self.commit(key, new_tat)
+        return allowed, retry_after
+
+class ClientKeyResolver:
+    """Work out who a request is from when it arrives through the ALB/ingress.
+
+    The client IP is found by walking X-Forwarded-For from the right and
+    skipping every hop that is a trusted proxy (TRUSTED_PROXY_CIDRS); the first
+    untrusted address is the caller. Without trusted proxies in front, the
+    header is ignored because any client could forge it.
+    """
+
+    def __init__(self, trusted_proxies=None):
+        if trusted_proxies is None:
+            trusted_proxies = os.getenv("TRUSTED_PROXY_CIDRS", "10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,127.0.0.1/32")
+        self.trusted_networks = [
+            ipaddress.ip_network(cidr.strip(), strict=False)
+            for cidr in trusted_proxies.split(",") if cidr.strip()
+        ]
+
+    def _is_trusted(self, address):
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_networks)
+
+    def client_ip(self, peer_host, forwarded_for=None):
+        """Resolve the caller's IP from the socket peer and the X-Forwarded-For header."""
+        if not peer_host or not self._is_trusted(peer_host) or not forwarded_for:
+            return peer_host or "unknown"
+
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not self._is_trusted(hop):
+                return hop
+        # Every hop is one of our proxies (internal traffic); use the left-most
+        return hops[0] if hops else peer_host
+
+    def identity(self, ip, user_id=None, session_id=None):
+        """Most specific identity available: user, then session, then IP."""
+        if user_id:
+            return f"user:{user_id}"
+        if session_id:
+            return f"session:{session_id}"
+        return f"ip:{ip}"
+
+class RedisGCRA:
+    """GCRA over a Redis-protocol store, shared by every replica.
+
+    One Lua script checks every limit for a request and charges all of them
+    only if all pass, atomically and in a single round trip (EVALSHA). It uses
+    the server clock so replicas with skewed clocks agree, and each key expires
+    once its TAT passes, so idle clients cost nothing.
+    """
+
+    SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local new_tats = {}
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i - 1])
+    local period = tonumber(ARGV[2 * i])
+    local tat = tonumber(redis.call('GET', key)) or now
+    if tat < now then tat = now end
+    local new_tat = tat + interval
+    if new_tat - now > period then
+        return {0, tostring(new_tat - period - now), i}
+    end
+    new_tats[i] = new_tat
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, tostring(new_tats[i]), 'PX', math.ceil((new_tats[i] - now) * 1000))
+end
+return {1, '0', 0}
+"""
+
+    def __init__(self, url=None, timeout=None, key_prefix="talk2me:ratelimit:"):
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+
+        self.url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.timeout = timeout or float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.05"))
+        self.key_prefix = key_prefix
+        self.redis = aioredis.from_url(
+            self.url,
+            socket_timeout=self.timeout,
+            socket_connect_timeout=self.timeout
+        )
+        self._script = self.redis.register_script(self.SCRIPT)
+
+    async def hit(self, keys, limiters):
+        """Return (allowed, retry_after, index of the rejecting limit or None).
+
+        Raises on store errors or when the store does not answer within `timeout`.
+        """
+        args = []
+        for limiter in limiters:
+            args.extend((limiter.emission_interval, limiter.period))
+        allowed, retry_after, index = await asyncio.wait_for(
+            self._script(keys=[self.key_prefix + key for key in keys], args=args),
+            timeout=self.timeout
+        )
+        return bool(allowed), float(retry_after), (int(index) - 1 if not allowed else None)
+
+    async def close(self):
+        await self.redis.aclose()
+
+class ChatRateLimiter:
+    """Applies several GCRA limits to a chat request at once.
+
+    - per identity (user_id, else session_id, else client IP)
+    - per client IP, looser, since campus or carrier NAT puts many users behind one address
+    - global, to keep the pod under the upstream quota while still allowing bursts
+
+    A request is only charged against any limit if every limit admits it.
+    Limits set to 0 are disabled.
+
+    With RATE_LIMIT_BACKEND=redis the limits are enforced across all replicas
+    through RedisGCRA. If the store errors or is slow, the request falls back to
+    the local limiters (with the global limit split across RATE_LIMIT_REPLICAS)
+    and the store is skipped for RATE_LIMIT_REDIS_RETRY seconds, so the hot path
+    never waits on an unhealthy store.
+    """
+
+    def __init__(self, per_identity=None, per_ip=None, global_per_minute=None, resolver=None, shared=None):
+        per_identity = per_identity if per_identity is not None else int(os.getenv("REQUESTS_PER_MINUTE", "60"))
+        per_ip = per_ip if per_ip is not None else int(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "300"))
+        global_per_minute = global_per_minute if global_per_minute is not None else int(os.getenv("RATE_LIMIT_GLOBAL_PER_MINUTE", "3000"))
+
+        self.resolver = resolver or ClientKeyResolver()
+        if shared is None and os.getenv("RATE_LIMIT_BACKEND", "memory").lower() == "redis":
+            shared = RedisGCRA()
+        self.shared = shared
+        self.shared_retry_interval = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "5"))
+        self._shared_down_until = 0.0
+        self.shared_fallbacks = 0
+
+        rates = {"identity": per_identity, "ip": per_ip, "global": global_per_minute}
+        # Cluster-wide limits as enforced by the shared store
+        self.shared_limits = {name: RateLimiter(requests_per_minute=rate) for name, rate in rates.items() if rate > 0}
+        if self.shared is not None:
+            # Local fallback only sees this pod's traffic, so split the pod-wide budget
+            replicas = max(1, int(os.getenv("RATE_LIMIT_REPLICAS", "2")))
+            rates["global"] = math.ceil(global_per_minute / replicas) if global_per_minute > 0 else 0
+            logger.info("Rate limiting: shared via %s, local fallback assumes %s replicas", self.shared.url, replicas)
+        self.limits = {name: RateLimiter(requests_per_minute=rate) for name, rate in rates.items() if rate > 0}
+
+    @property
+    def size(self):
+        """Tracked keys per local limit."""
+        return {name: limiter.size for name, limiter in self.limits.items()}
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.close()
+
+    def keys_for(self, ip, user_id=None, session_id=None):
+        return {
+            "identity": self.resolver.identity(ip, user_id, session_id),
+            "ip": f"ip:{ip}",
+            "global": "global",
+        }
+
+    def hit(self, keys, now=None):
+        """Check every limit, charge all of them only if all pass.
+
+        Returns (allowed, retry_after_seconds, name of the limit that rejected).
+        """
+        now = time.monotonic() if now is None else now
+        pending = []
+        for name, limiter in self.limits.items():
+            limiter.sweep(now)
+            allowed, retry_after, new_tat = limiter.check(keys[name], now)
+            if not allowed:
+                RATE_LIMIT_REJECTIONS.inc(name)
+                return False, retry_after, name
+            pending.append((limiter, keys[name], new_tat))
+
+        for limiter, key, new_tat in pending:
+            limiter.commit(key, new_tat)
+        return True, 0.0, None
+
+    async def hit_shared(self, keys):
+        """Enforce the limits cluster-wide, falling back to local limiting on store trouble."""
+        now = time.monotonic()
+        if self.shared is None or now < self._shared_down_until:
+            return self.hit(keys, now)
+
+        names = list(self.shared_limits)
+        try:
+            allowed, retry_after, index = await self.shared.hit(
+                [keys[name] for name in names], list(self.shared_limits.values())
             )
-        
-        # Add current request timestamp
-        self.requests[client_ip].append(current_time)
-        
-        return True
\ No newline at end of file
+        except (asyncio.TimeoutError, OSError, aioredis.RedisError) as e:
+            self.shared_fallbacks += 1
+            self._shared_down_until = now + self.shared_retry_interval
+            logger.warning("Shared rate limit store unavailable, limiting locally for %ss: %r", self.shared_retry_interval, e)
+            return self.hit(keys, now)
+
+        if not allowed:
+            RATE_LIMIT_REJECTIONS.inc(names[index])
+            return False, retry_after, names[index]
+        return True, 0.0, None
+
+class RateLimitMiddleware:
+    """Pure ASGI front for ChatRateLimiter that rejects before the body is read.
+
+    Identity comes from the X-User-Id / X-Session-Id headers (falling back to
+    the client IP), so an over-limit request is answered from the scope alone:
+    no body bytes are received, nothing is parsed or validated, and the
+    request never reaches the logging middleware or the endpoint. Rejections
+    get a pre-serialized 429 with Retry-After and RateLimit-* headers.
+    """
+
+    BODY = b'{"detail":"Rate limit exceeded. Please try again later."}'
+
+    def __init__(self, app, limiter, paths=("/api/chat", "/api/chat/stream")):
+        self.app = app
+        self.limiter = limiter
+        self.paths = frozenset(paths)
+        self._base_headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(self.BODY)).encode()),
+        ]
+        # Advertise the cluster-wide policy of each limit
+        self._limit_headers = {
+            name: [
+                (b"ratelimit-limit", str(limit.requests_per_minute).encode()),
+                (b"ratelimit-policy", f"{limit.requests_per_minute};w=60".encode()),
+                (b"ratelimit-remaining", b"0"),
+            ]
+            for name, limit in limiter.shared_limits.items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        # CORS preflights and other routes pass straight through
+        if scope["type"] != "http" or scope["path"] not in self.paths or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        forwarded_for = user_id = session_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                forwarded_for = value.decode("latin-1")
+            elif name == b"x-user-id":
+                user_id = value.decode("latin-1")
+            elif name == b"x-session-id":
+                session_id = value.decode("latin-1")
+
+        client = scope.get("client")
+        ip = self.limiter.resolver.client_ip(client[0] if client else None, forwarded_for)
+        allowed, retry_after, limit_name = await self.limiter.hit_shared(self.limiter.keys_for(ip, user_id, session_id))
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        reset = str(math.ceil(retry_after)).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": self._base_headers + self._limit_headers[limit_name] + [
+                (b"retry-after", reset),
+                (b"ratelimit-reset", reset),
+            ],
+        })
+        await send({"type": "http.response.body", "body": self.BODY})
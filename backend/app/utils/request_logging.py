@@ -0,0 +1,127 @@
+# app/utils/request_logging.py
+import os
+import time
+import traceback
+from app.utils import log_context
+from app.utils.logger import logger
+from app.utils.metrics import REQUEST_LATENCY, REQUESTS_IN_FLIGHT
+
+class RequestLoggingMiddleware:
+    """Pure ASGI request logging: one structured event per request.
+
+    Wraps `send` to note the status and count body bytes, and logs method,
+    path, status, bytes, duration and stage timings once the last body chunk
+    has gone out, so streaming responses are timed to completion and pass
+    through untouched. Requests that fail before a response has started get a
+    500.
+
+    Stage spans recorded during the request are returned in a Server-Timing
+    header (those finished before the response starts, so a streamed reply
+    only reports its setup stages) and requests slower than SLOW_REQUEST_MS
+    are logged as a WARNING with their stage breakdown. Also feeds the
+    per-route latency histogram and the in-flight gauge.
+
+    Each request gets a request id (a well-formed inbound X-Request-ID or a
+    random one) that is bound to every log record the request produces and
+    returned in the X-Request-ID response header.
+    """
+
+    ERROR_BODY = b'{"detail":"Internal server error"}'
+
+    def __init__(self, app, slow_request_ms=None):
+        self.app = app
+        self.slow_request_ms = slow_request_ms or float(os.getenv("SLOW_REQUEST_MS", "5000"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = None
+        sent_bytes = 0
+        outcome = "disconnected"
+
+        inbound_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                inbound_id = value.decode("latin-1")
+                break
+        request_id = log_context.new_request_id(inbound_id)
+        token = log_context.begin_request(request_id)
+        timings = log_context.current_request()["timings"]
+        request_id_header = (b"x-request-id", request_id.encode())
+        REQUESTS_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            nonlocal status_code, sent_bytes, outcome
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                total_ms = (time.perf_counter() - started) * 1000
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    request_id_header,
+                    (b"server-timing", log_context.server_timing(timings, total_ms).encode()),
+                    (b"timing-allow-origin", b"*"),
+                ]
+            elif message["type"] == "http.response.body":
+                sent_bytes += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    outcome = "completed"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            outcome = "failed"
+            logger.error("Request %s %s failed with error: %s", scope["method"], scope["path"], str(e))
+            logger.error(traceback.format_exc())
+            if status_code is not None:
+                raise
+            status_code = 500
+            sent_bytes = len(self.ERROR_BODY)
+            await send({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(sent_bytes).encode()),
+                    request_id_header,
+                ],
+            })
+            await send({"type": "http.response.body", "body": self.ERROR_BODY})
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            duration = time.perf_counter() - started
+            REQUEST_LATENCY.observe(duration, _route(scope), scope["method"], str(status_code))
+            duration_ms = duration * 1000
+            event = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "bytes": sent_bytes,
+                "duration_ms": round(duration_ms, 2),
+                "outcome": outcome,
+                "timings": dict(timings),
+            }
+            logger.info(
+                "request method=%s path=%s status=%s bytes=%d duration_ms=%.2f outcome=%s",
+                event["method"], event["path"], status_code, sent_bytes, duration_ms, outcome,
+                extra={"http": event, "always_log": True}
+            )
+            if duration_ms > self.slow_request_ms:
+                logger.warning(
+                    "Slow request %s %s took %.0fms: %s",
+                    event["method"], event["path"], duration_ms, log_context.server_timing(event["timings"]),
+                    extra={"always_log": True}
+                )
+            log_context.end_request(token)
+
+def _route(scope):
+    """Route template for metrics labels, so path parameters don't explode cardinality."""
+    if "endpoint" not in scope:
+        return "unmatched"
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        path = path.replace(str(value), "{" + name + "}")
+    return path
@@ -0,0 +1,144 @@
+# app/utils/retry.py
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+import httpx
+from app.utils.logger import logger
+from app.utils.metrics import UPSTREAM_RETRIES, UPSTREAM_RETRIES_SKIPPED
+
+# Statuses that mean the request was turned away, not processed
+RETRYABLE_STATUSES = frozenset({429, 502, 503, 504})
+# Failures before DeepSeek could have accepted the request (no connection, or the
+# body never fully sent). Read errors, protocol errors and read timeouts are not
+# here: they happen after the POST was accepted, when a billed completion may
+# already be running, so retrying would duplicate it
+RETRYABLE_ERRORS = {
+    httpx.ConnectTimeout: "connect_timeout",
+    httpx.ConnectError: "connect_error",
+    httpx.PoolTimeout: "pool_timeout",
+    httpx.WriteError: "write_error",
+}
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RetryBudget:
+    """Caps retries at `ratio` of first attempts, plus `min_per_second` to keep
+    low-traffic retries possible, so an outage is not multiplied by retries."""
+
+    def __init__(self, ratio, min_per_second, cap=None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap or max(1.0, 10 * min_per_second)
+        self.balance = self.cap
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.cap, self.balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        self._refill()
+        self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self):
+        self._refill()
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+class RetryPolicy:
+    """Retries upstream calls that failed before being processed.
+
+    Retried: failures to connect or send the request, and 429/502/503/504
+    responses. Delays use exponential backoff with decorrelated jitter (each
+    delay drawn between `base_delay` and three times the previous one, capped
+    at `max_delay`) and are stretched to honour Retry-After. No retry is made
+    if the wait plus `min_attempt_time` would overrun the caller's timeout, if
+    Retry-After asks for longer than `max_retry_after`, or if the retry budget
+    is spent; the last response or error is then returned or raised as is.
+    """
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, max_retry_after=None,
+                 min_attempt_time=None, budget_ratio=None, budget_min_per_second=None):
+        self.max_attempts = max_attempts or int(os.getenv("UPSTREAM_RETRY_MAX_ATTEMPTS", "3"))
+        self.base_delay = base_delay or float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
+        self.max_delay = max_delay or float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "2"))
+        self.max_retry_after = max_retry_after or float(os.getenv("UPSTREAM_RETRY_MAX_RETRY_AFTER", "5"))
+        self.min_attempt_time = min_attempt_time or float(os.getenv("UPSTREAM_RETRY_MIN_ATTEMPT_TIME", "2"))
+        self.budget = RetryBudget(
+            budget_ratio if budget_ratio is not None else float(os.getenv("UPSTREAM_RETRY_BUDGET_RATIO", "0.1")),
+            budget_min_per_second if budget_min_per_second is not None else float(os.getenv("UPSTREAM_RETRY_BUDGET_MIN_PER_SECOND", "1"))
+        )
+
+    def backoff(self, previous):
+        """Decorrelated jitter: the next delay given the previous one."""
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def _skip(self, delay, retry_after, expires):
+        """Why this retry should not be made, or None to go ahead."""
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return "retry_after"
+        if expires is not None and time.monotonic() + delay + self.min_attempt_time > expires:
+            return "deadline"
+        if not self.budget.withdraw():
+            return "budget"
+        return None
+
+    async def run(self, attempt, timeout=None):
+        """Call `attempt(timeout)` (returning an httpx response) under the retry policy.
+
+        Each attempt gets the time left of `timeout`. Responses given up on
+        are closed before the next attempt.
+        """
+        self.budget.deposit()
+        expires = None if timeout is None else time.monotonic() + timeout
+        delay = self.base_delay
+        for number in range(1, self.max_attempts + 1):
+            remaining = None if expires is None else max(0.0, expires - time.monotonic())
+            response = None
+            try:
+                response = await attempt(remaining)
+            except tuple(RETRYABLE_ERRORS) as e:
+                if number == self.max_attempts:
+                    raise
+                reason = next(name for error, name in RETRYABLE_ERRORS.items() if isinstance(e, error))
+                retry_after = None
+                error = e
+            else:
+                if response.status_code not in RETRYABLE_STATUSES or number == self.max_attempts:
+                    return response
+                reason = str(response.status_code)
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+                error = None
+
+            delay = self.backoff(delay)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            skipped = self._skip(delay, retry_after, expires)
+            if skipped is not None:
+                UPSTREAM_RETRIES_SKIPPED.inc(skipped)
+                logger.warning("Not retrying upstream %s (%s)", reason, skipped)
+                if error is not None:
+                    raise error
+                return response
+
+            UPSTREAM_RETRIES.inc(reason)
+            logger.warning("Upstream %s on attempt %d, retrying in %.2fs", reason, number, delay)
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(delay)
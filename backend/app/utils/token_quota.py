@@ -0,0 +1,280 @@
+# app/utils/token_quota.py
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple
+from app.utils.logger import logger
+from app.utils.metrics import TOKEN_QUOTA_REJECTIONS
+
+# Shared budgets are optional; only needed when RATE_LIMIT_BACKEND=redis
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+class QuotaExceeded(Exception):
+    """A tokens-per-minute budget cannot cover the estimated cost of a request."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Token quota '{scope}' exceeded")
+        self.scope = scope
+        self.retry_after = retry_after
+
+class Reservation(NamedTuple):
+    keys: List[str]
+    estimate: int
+    # Charged against the shared store rather than this pod's buckets
+    shared: bool = False
+
+class RedisTokenBuckets:
+    """The token buckets of TokenQuota kept in a Redis-protocol store for all replicas.
+
+    Like RedisGCRA: one Lua script per operation, atomic and in one round
+    trip, on the server clock. A bucket is a hash of level and last update,
+    and expires once it would have refilled completely.
+    """
+
+    REFILL = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local function level_of(key, capacity)
+    local state = redis.call('HMGET', key, 'level', 'updated')
+    if not state[1] then return capacity end
+    return math.min(capacity, tonumber(state[1]) + (now - tonumber(state[2])) * capacity / 60)
+end
+local function store(key, capacity, level)
+    redis.call('HSET', key, 'level', tostring(level), 'updated', tostring(now))
+    redis.call('PEXPIRE', key, math.max(1000, math.ceil((capacity - level) * 60000 / capacity) + 1000))
+end
+"""
+
+    # ARGV: estimate, force (0/1), then one capacity per key
+    RESERVE = REFILL + """
+local estimate = tonumber(ARGV[1])
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 + i])
+    local level = level_of(key, capacity)
+    local needed = math.min(estimate, capacity)
+    if level < needed and ARGV[2] ~= '1' then
+        return {0, tostring((needed - level) * 60 / capacity), i}
+    end
+    levels[i] = level
+end
+for i, key in ipairs(KEYS) do
+    store(key, tonumber(ARGV[2 + i]), levels[i] - estimate)
+end
+return {1, '0', 0}
+"""
+
+    # ARGV: tokens to give back (negative to charge more), then one capacity per key
+    ADJUST = REFILL + """
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[1 + i])
+    store(key, capacity, level_of(key, capacity) + tonumber(ARGV[1]))
+end
+return 1
+"""
+
+    def __init__(self, url=None, timeout=None, key_prefix="talk2me:tokens:"):
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+
+        self.url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.timeout = timeout or float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.05"))
+        self.key_prefix = key_prefix
+        self.redis = aioredis.from_url(
+            self.url,
+            socket_timeout=self.timeout,
+            socket_connect_timeout=self.timeout
+        )
+        self._reserve = self.redis.register_script(self.RESERVE)
+        self._adjust = self.redis.register_script(self.ADJUST)
+
+    async def reserve(self, keys, capacities, estimate, force=False):
+        """Return (allowed, retry_after, index of the rejecting budget or None).
+
+        Raises on store errors or when the store does not answer within `timeout`.
+        """
+        allowed, retry_after, index = await asyncio.wait_for(
+            self._reserve(
+                keys=[self.key_prefix + key for key in keys],
+                args=[estimate, 1 if force else 0, *capacities]
+            ),
+            timeout=self.timeout
+        )
+        return bool(allowed), float(retry_after), (int(index) - 1 if not allowed else None)
+
+    async def adjust(self, keys, capacities, tokens):
+        await asyncio.wait_for(
+            self._adjust(keys=[self.key_prefix + key for key in keys], args=[tokens, *capacities]),
+            timeout=self.timeout
+        )
+
+    async def close(self):
+        await self.redis.aclose()
+
+class TokenQuota:
+    """Tokens-per-minute budgets for LLM spend, per user and for the whole pod.
+
+    Each budget is a token bucket (level and last update per key) refilled at
+    tpm/60 per second. A request pre-charges its estimated cost (prompt plus the
+    max_tokens ceiling) before the upstream call, so load is shed here before
+    the provider starts answering 429; once the response's `usage` block is
+    known the charge is reconciled to the real count, which may leave a bucket
+    in debt.
+
+    The budgets are cluster-wide. With RATE_LIMIT_BACKEND=redis they are
+    charged in the shared store (RedisTokenBuckets) through `reserve_shared`
+    and `reconcile_shared`; if the store errors or is slow, turns fall back to
+    the local buckets and the store is skipped for RATE_LIMIT_REDIS_RETRY
+    seconds. Local buckets only see this pod's traffic, so they hold a
+    1/RATE_LIMIT_REPLICAS share of each budget.
+    """
+
+    def __init__(self, user_tpm=None, global_tpm=None, max_keys=100_000, shared=None):
+        self.user_tpm = user_tpm if user_tpm is not None else int(os.getenv("TOKEN_QUOTA_USER_TPM", "20000"))
+        self.global_tpm = global_tpm if global_tpm is not None else int(os.getenv("TOKEN_QUOTA_GLOBAL_TPM", "300000"))
+        self.max_keys = max_keys
+        self.replicas = max(1, int(os.getenv("RATE_LIMIT_REPLICAS", "2")))
+        self._buckets = OrderedDict()
+        self.rejections = 0
+
+        if shared is None and os.getenv("RATE_LIMIT_BACKEND", "memory").lower() == "redis":
+            shared = RedisTokenBuckets()
+        self.shared = shared
+        self.shared_retry_interval = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "5"))
+        self._shared_down_until = 0.0
+        self.shared_fallbacks = 0
+
+    @property
+    def size(self):
+        return len(self._buckets)
+
+    def _cluster_capacity(self, key):
+        return self.global_tpm if key == "global" else self.user_tpm
+
+    def _capacity(self, key):
+        """This pod's share of a budget, for the local buckets."""
+        return math.ceil(self._cluster_capacity(key) / self.replicas)
+
+    def _level(self, key, now):
+        """Current token level for key after refilling since its last update."""
+        capacity = self._capacity(key)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return capacity
+        level, updated = bucket
+        return min(capacity, level + (now - updated) * capacity / 60.0)
+
+    def _sweep(self, now):
+        # Buckets that have refilled completely are the same as absent ones
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key = next(iter(self._buckets))
+            if self._level(key, now) < self._capacity(key) and len(self._buckets) <= self.max_keys:
+                return
+            self._buckets.popitem(last=False)
+
+    def _set(self, key, level, now):
+        self._buckets[key] = (level, now)
+        self._buckets.move_to_end(key)
+
+    def keys_for(self, user_key=None):
+        keys = []
+        if user_key and self.user_tpm > 0:
+            keys.append(f"user:{user_key}")
+        if self.global_tpm > 0:
+            keys.append("global")
+        return keys
+
+    def reserve(self, user_key, estimate, force=False):
+        """Pre-charge `estimate` tokens; return a Reservation to reconcile later.
+
+        Raises QuotaExceeded (with a retry_after) if any budget cannot cover it,
+        unless `force` is set, in which case the turn is charged regardless.
+        """
+        now = time.monotonic()
+        self._sweep(now)
+        keys = self.keys_for(user_key)
+
+        levels = {}
+        for key in keys:
+            level = self._level(key, now)
+            # A request larger than the whole budget only needs a full bucket
+            needed = min(estimate, self._capacity(key))
+            if level < needed and not force:
+                self._reject(key, (needed - level) * 60.0 / self._capacity(key))
+            levels[key] = level
+
+        for key, level in levels.items():
+            self._set(key, level - estimate, now)
+        return Reservation(keys, estimate)
+
+    def _reject(self, key, retry_after):
+        self.rejections += 1
+        scope = "global" if key == "global" else "user"
+        TOKEN_QUOTA_REJECTIONS.inc(scope)
+        logger.warning("Token quota '%s' exceeded, retry in %.1fs", scope, retry_after)
+        raise QuotaExceeded(scope, retry_after)
+
+    def _shared_failed(self, now, error):
+        self.shared_fallbacks += 1
+        self._shared_down_until = now + self.shared_retry_interval
+        logger.warning("Shared token quota store unavailable, using local budgets for %ss: %r", self.shared_retry_interval, error)
+
+    def reconcile(self, reservation, actual):
+        """Replace the pre-charged estimate with the real token count."""
+        keys, estimate, _ = reservation
+        now = time.monotonic()
+        for key in keys:
+            self._set(key, self._level(key, now) + estimate - actual, now)
+
+    async def reserve_shared(self, user_key, estimate, force=False):
+        """`reserve` against the cluster-wide budgets, falling back to local ones on store trouble."""
+        now = time.monotonic()
+        if self.shared is None or now < self._shared_down_until:
+            return self.reserve(user_key, estimate, force)
+
+        keys = self.keys_for(user_key)
+        if not keys:
+            return Reservation(keys, estimate)
+        capacities = [self._cluster_capacity(key) for key in keys]
+        try:
+            allowed, retry_after, index = await self.shared.reserve(keys, capacities, estimate, force)
+        except (asyncio.TimeoutError, OSError, aioredis.RedisError) as e:
+            self._shared_failed(now, e)
+            return self.reserve(user_key, estimate, force)
+
+        if not allowed:
+            self._reject(keys[index], retry_after)
+        return Reservation(keys, estimate, shared=True)
+
+    async def reconcile_shared(self, reservation, actual):
+        """`reconcile` wherever the reservation was charged."""
+        if not reservation.shared:
+            self.reconcile(reservation, actual)
+            return
+        keys, estimate, _ = reservation
+        capacities = [self._cluster_capacity(key) for key in keys]
+        try:
+            await self.shared.adjust(keys, capacities, estimate - actual)
+        except (asyncio.TimeoutError, OSError, aioredis.RedisError) as e:
+            # The charge stays at the estimate; the bucket refills on its own
+            self._shared_failed(time.monotonic(), e)
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.close()
+
+    def stats(self):
+        return {
+            "keys": self.size,
+            "rejections": self.rejections,
+            "shared": self.shared is not None,
+            "shared_fallbacks": self.shared_fallbacks,
+            "global_available": int(self._level("global", time.monotonic())) if self.global_tpm > 0 else None,
+        }
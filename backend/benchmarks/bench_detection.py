@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# bench_detection.py - Compare the compiled single-pass DetectionService against the
+# original per-keyword substring scans on 1KB, 10KB and 100KB messages.
+#
+# Run from the backend directory: python benchmarks/bench_detection.py
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.detection_service import CATEGORY_KEYWORDS, CRISIS_KEYWORDS, DetectionService
+from app.utils import keyword_matcher
+
+
+def legacy_detect_crisis(text):
+    crisis_keywords = [
+        "suicide", "kill myself", "end my life", "don't want to live",
+        "self harm", "hurt myself", "cutting myself", "overdose"
+    ]
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in crisis_keywords)
+
+
+def legacy_categorize_message(text):
+    categories = {
+        "mental_health": ["anxiety", "depression", "stress", "overwhelm", "therapy", "counseling"],
+        "sexual_health": ["sex", "contraception", "protection", "std", "sti", "abortion", "pregnancy"],
+        "substance_use": ["drugs", "alcohol", "addiction", "smoking", "vape", "marijuana", "weed"],
+        "physical_health": ["exercise", "workout", "diet", "nutrition", "sleep", "eating"],
+        "relationships": ["friend", "partner", "dating", "breakup", "relationship", "family"]
+    }
+    text_lower = text.lower()
+    detected_categories = []
+    for category, keywords in categories.items():
+        if any(keyword in text_lower for keyword in keywords):
+            detected_categories.append(category)
+    return detected_categories
+
+
+def legacy(text):
+    return legacy_detect_crisis(text), legacy_categorize_message(text)
+
+
+def compiled(text):
+    result = DetectionService.scan(text)
+    return result.crisis_detected, result.categories
+
+
+def fallback_matcher():
+    """Build the matcher the service uses when pyahocorasick is not installed."""
+    installed = keyword_matcher.ahocorasick
+    keyword_matcher.ahocorasick = None
+    try:
+        return keyword_matcher.KeywordMatcher({"crisis": CRISIS_KEYWORDS, **CATEGORY_KEYWORDS})
+    finally:
+        keyword_matcher.ahocorasick = installed
+
+
+FILLER = (
+    "so today was kind of a lot honestly and i am not sure what to do about it "
+    "my classes are fine but i keep thinking about everything that happened last week "
+)
+
+
+def make_message(size, keyword_density):
+    """Build a message of `size` bytes with a keyword sprinkled in every so often."""
+    rng = random.Random(size)
+    keywords = ["stress", "sleep", "friend", "vape", "therapy"]
+    parts = []
+    length = 0
+    while length < size:
+        chunk = FILLER if rng.random() > keyword_density else f"{rng.choice(keywords)} "
+        parts.append(chunk)
+        length += len(chunk)
+    return "".join(parts)[:size]
+
+
+def main():
+    fallback = fallback_matcher()
+    print(f"DetectionService matcher backend: {DetectionService.matcher_backend()}")
+    print(f"{'size':>8} {'keywords':>9} {'legacy us':>12} {'compiled us':>12} {'speedup':>8} {'tokens us':>10}")
+    for size in (1_000, 10_000, 100_000):
+        for label, density in (("none", 0.0), ("sparse", 0.05)):
+            text = make_message(size, density)
+            assert legacy(text) == compiled(text), "implementations disagree"
+
+            number = max(1, 200_000 // size)
+            legacy_s = min(timeit.repeat(lambda: legacy(text), number=number, repeat=5)) / number
+            compiled_s = min(timeit.repeat(lambda: compiled(text), number=number, repeat=5)) / number
+            tokens_s = min(timeit.repeat(lambda: fallback.scan(text), number=number, repeat=5)) / number
+            print(f"{size:>8} {label:>9} {legacy_s * 1e6:>12.1f} {compiled_s * 1e6:>12.1f} "
+                  f"{legacy_s / compiled_s:>7.2f}x {tokens_s * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# bench_detection_accuracy.py - Score crisis/topic detection against the labeled corpus in
+# detection_corpus.jsonl: precision, recall and throughput (messages/sec) for the original
+# substring matcher and the current token-aware DetectionService.
+#
+# Run from the backend directory: python benchmarks/bench_detection_accuracy.py
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.detection_service import DetectionService
+from bench_detection import legacy, fallback_matcher
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "detection_corpus.jsonl")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+def labels_of(crisis, categories):
+    return set(categories) | ({"crisis"} if crisis else set())
+
+
+def current(text):
+    result = DetectionService.scan(text)
+    return result.crisis_detected, result.categories
+
+
+def score(detect, corpus):
+    """Return ({label: (tp, fp, fn)}, list of misclassified messages)."""
+    counts = {}
+    mistakes = []
+    for row in corpus:
+        expected = labels_of(row["crisis"], row["categories"])
+        predicted = labels_of(*detect(row["text"]))
+        for label in expected | predicted:
+            tp, fp, fn = counts.get(label, (0, 0, 0))
+            counts[label] = (tp + (label in expected and label in predicted),
+                             fp + (label in predicted and label not in expected),
+                             fn + (label in expected and label not in predicted))
+        if expected != predicted:
+            mistakes.append((row["text"], sorted(expected), sorted(predicted)))
+    return counts, mistakes
+
+
+def ratio(numerator, denominator):
+    return numerator / denominator if denominator else 1.0
+
+
+def throughput(detect, corpus, seconds=1.0):
+    texts = [row["text"] for row in corpus]
+    processed = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for text in texts:
+            detect(text)
+        processed += len(texts)
+    return processed / (time.perf_counter() - started)
+
+
+def report(name, detect, corpus):
+    counts, mistakes = score(detect, corpus)
+    print(f"\n== {name}")
+    print(f"{'label':>16} {'precision':>10} {'recall':>8}")
+    totals = [0, 0, 0]
+    for label in sorted(counts):
+        tp, fp, fn = counts[label]
+        totals = [totals[0] + tp, totals[1] + fp, totals[2] + fn]
+        print(f"{label:>16} {ratio(tp, tp + fp):>10.2f} {ratio(tp, tp + fn):>8.2f}")
+    tp, fp, fn = totals
+    print(f"{'micro':>16} {ratio(tp, tp + fp):>10.2f} {ratio(tp, tp + fn):>8.2f}")
+    print(f"throughput: {throughput(detect, corpus):,.0f} messages/sec")
+    for text, expected, predicted in mistakes:
+        print(f"  miss: {text!r} expected={expected} got={predicted}")
+
+
+def main():
+    corpus = load_corpus()
+    fallback = fallback_matcher()
+
+    def tokens(text):
+        labels, _ = fallback.scan(text)
+        return "crisis" in labels, [label for label in labels if label != "crisis"]
+
+    print(f"corpus: {len(corpus)} labeled messages")
+    report("original substring matcher", legacy, corpus)
+    report(f"DetectionService ({DetectionService.matcher_backend()})", current, corpus)
+    report(f"DetectionService ({fallback.backend} fallback)", tokens, corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# bench_language.py - Per-call latency distribution of language detection: plain
+# langdetect.detect (the original helper) versus helpers.detect_language with its
+# fast paths, prefix cap and LRU cache, on cold and warm caches.
+#
+# Run from the backend directory: python benchmarks/bench_language.py
+
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langdetect import detect, LangDetectException
+
+from app.utils import helpers
+
+MESSAGES = [
+    "hey", "hi there", "lol ok", "I feel so stressed about exams",
+    "how do I know if I have anxiety?", "my friends all vape, should I try it",
+    "is it normal to not sleep for two days", "can you get pregnant on your period",
+    "I think my partner is cheating on me and I don't know what to do",
+    "hola, como estas? me siento triste", "tengo mucha ansiedad por la escuela",
+    "je suis très fatigué ces jours-ci", "ich habe Angst vor der Prüfung",
+    "こんにちは、最近よく眠れません", "요즘 너무 우울해요", "Μου λείπει ο ύπνος",
+    "привет, мне очень грустно", "我最近压力很大",
+    "so today was kind of a lot honestly and I am not sure what to do about it " * 20,
+]
+
+
+def original(text):
+    try:
+        return detect(text)
+    except LangDetectException:
+        return "en"
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99),
+        "max": ordered[-1], "mean": statistics.fmean(ordered),
+    }
+
+
+def measure(detect_fn, messages, calls):
+    samples = []
+    for index in range(calls):
+        text = messages[index % len(messages)]
+        started = time.perf_counter()
+        detect_fn(text)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return percentiles(samples)
+
+
+def unique_messages(count):
+    """Distinct messages so every call misses the cache."""
+    rng = random.Random(0)
+    return [f"{rng.choice(MESSAGES)} #{index}" for index in range(count)]
+
+
+def main():
+    helpers.preload_language_profiles()
+    calls = 2000
+
+    rows = [("langdetect.detect (original)", measure(original, unique_messages(calls), calls))]
+    helpers._language_cache.clear()
+    rows.append(("detect_language, cold cache", measure(helpers.detect_language, unique_messages(calls), calls)))
+    rows.append(("detect_language, warm cache", measure(helpers.detect_language, MESSAGES, calls)))
+
+    print(f"{calls} calls each, microseconds per call")
+    print(f"{'':>30} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'mean':>9}")
+    for name, stats in rows:
+        print(f"{name:>30} " + " ".join(f"{stats[key]:>9.1f}" for key in ("p50", "p90", "p99", "max", "mean")))
+
+    def uncached(text):
+        helpers._language_cache.clear()
+        return helpers.detect_language(text)
+
+    deterministic = all(len({uncached(m) for _ in range(5)}) == 1 for m in MESSAGES)
+    print(f"deterministic across repeated calls: {deterministic}")
+
+
+if __name__ == "__main__":
+    main()
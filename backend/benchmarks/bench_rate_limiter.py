@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# bench_rate_limiter.py - Compare the GCRA RateLimiter against the original
+# list-filtering limiter with 100k distinct clients: time per call, tracked keys
+# and retained memory.
+#
+# Run from the backend directory: python benchmarks/bench_rate_limiter.py
+
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+
+from app.utils.rate_limiter import RateLimiter
+
+CLIENTS = 100_000
+CALLS = 300_000
+
+
+class LegacyRateLimiter:
+    """The original implementation, kept here for comparison."""
+
+    def __init__(self, requests_per_minute=60):
+        self.requests_per_minute = requests_per_minute
+        self.requests = defaultdict(list)
+
+    async def __call__(self, request):
+        client_ip = request.client.host
+        current_time = time.time()
+        self.requests[client_ip] = [req_time for req_time in self.requests[client_ip]
+                                    if current_time - req_time < 60]
+        if len(self.requests[client_ip]) >= self.requests_per_minute:
+            raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
+        self.requests[client_ip].append(current_time)
+        return True
+
+
+class FakeClient:
+    __slots__ = ("host",)
+
+    def __init__(self, host):
+        self.host = host
+
+
+class FakeRequest:
+    __slots__ = ("client",)
+
+    def __init__(self, host):
+        self.client = FakeClient(host)
+
+
+def make_requests():
+    """100k distinct clients, with a hot 1% sending most of the traffic."""
+    rng = random.Random(0)
+    hosts = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(CLIENTS)]
+    hot = hosts[:CLIENTS // 100]
+    picks = hosts + [rng.choice(hot) for _ in range(CALLS - CLIENTS)]
+    rng.shuffle(picks)
+    return [FakeRequest(host) for host in picks]
+
+
+async def drive_legacy(limiter, requests):
+    rejected = 0
+    for request in requests:
+        try:
+            await limiter(request)
+        except HTTPException:
+            rejected += 1
+    return rejected
+
+
+def drive_gcra(limiter, requests):
+    rejected = 0
+    for request in requests:
+        allowed, _ = limiter.hit(request.client.host)
+        if not allowed:
+            rejected += 1
+    return rejected
+
+
+def run(name, limiter, requests, drive):
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    rejected = drive(limiter, requests)
+    elapsed = time.perf_counter() - started
+    retained = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(baseline, "filename"))
+    tracemalloc.stop()
+
+    keys = len(limiter.requests) if hasattr(limiter, "requests") else limiter.size
+    print(f"{name:>8} {elapsed / len(requests) * 1e6:>10.2f} {keys:>10} {retained / 1e6:>12.1f} {rejected:>10}")
+
+
+def main():
+    requests = make_requests()
+    print(f"{CALLS} calls from {CLIENTS} distinct clients")
+    print(f"{'':>8} {'us/call':>10} {'keys':>10} {'retained MB':>12} {'rejected':>10}")
+    run("legacy", LegacyRateLimiter(requests_per_minute=60), requests,
+        lambda limiter, requests: asyncio.run(drive_legacy(limiter, requests)))
+    run("gcra", RateLimiter(requests_per_minute=60), requests, drive_gcra)
+
+
+if __name__ == "__main__":
+    main()
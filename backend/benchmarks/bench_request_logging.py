@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# bench_request_logging.py - Per-request overhead of the original
+# @app.middleware("http") log_requests wrapper (BaseHTTPMiddleware) versus the
+# pure ASGI RequestLoggingMiddleware, for a small JSON response and a streamed
+# one, measured by driving the ASGI app directly (no sockets).
+#
+# Run from the backend directory: python benchmarks/bench_request_logging.py
+
+import asyncio
+import io
+import logging
+import os
+import statistics
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.utils.logger import logger
+from app.utils.request_logging import RequestLoggingMiddleware
+
+REQUESTS = 5000
+CHUNKS = 20
+
+
+def add_routes(app):
+    @app.get("/json")
+    async def json_route():
+        return {"message": "ok"}
+
+    @app.get("/stream")
+    async def stream_route():
+        async def chunks():
+            for _ in range(CHUNKS):
+                yield b"event: token\ndata: {\"delta\": \"hi \"}\n\n"
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+def bare_app():
+    return add_routes(FastAPI())
+
+
+def legacy_app():
+    """The original log_requests middleware, kept here for comparison."""
+    app = add_routes(FastAPI())
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        request_id = str(time.time())
+        logger.info(f"Request {request_id} started: {request.method} {request.url.path}")
+        origin = request.headers.get("origin", "No Origin")
+        logger.info(f"Request origin: {origin}")
+        try:
+            response = await call_next(request)
+            logger.info(f"Request {request_id} completed with status code {response.status_code}")
+            return response
+        except Exception as e:
+            logger.error(f"Request {request_id} failed with error: {str(e)}")
+            logger.error(traceback.format_exc())
+            return JSONResponse(status_code=500, content={"detail": "Internal server error"})
+
+    return app
+
+
+def asgi_app():
+    app = add_routes(FastAPI())
+    app.add_middleware(RequestLoggingMiddleware)
+    return app
+
+
+async def call(app, path):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+
+    received = 0
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        # The body once, then block until the response is done, as a real server does
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return received
+
+
+async def drive(app, path):
+    # Warm up routing and the middleware stack before timing
+    for _ in range(100):
+        await call(app, path)
+    timings = []
+    for _ in range(REQUESTS):
+        started = time.perf_counter()
+        await call(app, path)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    # Log to memory so the numbers reflect formatting, not terminal or disk speed
+    logger.handlers = [logging.StreamHandler(io.StringIO())]
+
+    print(f"{REQUESTS} requests per case, {CHUNKS}-chunk stream")
+    print(f"{'':>8} {'path':>8} {'mean us':>10} {'p99 us':>10} {'overhead us':>12} {'log lines':>10}")
+    for path in ("/json", "/stream"):
+        baseline = None
+        for name, factory in (("bare", bare_app), ("legacy", legacy_app), ("asgi", asgi_app)):
+            stream = logger.handlers[0].stream
+            stream.seek(0)
+            stream.truncate()
+            timings = asyncio.run(drive(factory(), path))
+            lines = stream.getvalue().count("\n") / (REQUESTS + 100)
+            mean = statistics.fmean(timings) * 1e6
+            p99 = statistics.quantiles(timings, n=100)[98] * 1e6
+            baseline = mean if baseline is None else baseline
+            print(f"{name:>8} {path:>8} {mean:>10.1f} {p99:>10.1f} {mean - baseline:>12.1f} {lines:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -42,7 +42,14 @@ try:
     print(f"\nSending request to {url}...")
     print(f"Test message: '{test_message}'")
     
-    response = requests.post(url, headers=headers, json=payload, timeout=20)
+    # (connect, read), taken from the ceilings of the backend's adaptive upstream timeouts.
+    # requests restarts the read timeout on every byte received, so the second value is
+    # only a per-read ceiling, not a limit on the whole response like the backend's total.
+    timeout = (
+        float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_MAX", "5")),
+        float(os.getenv("UPSTREAM_TOTAL_TIMEOUT_MAX", "20"))
+    )
+    response = requests.post(url, headers=headers, json=payload, timeout=timeout)
     
     print(f"\nResponse status code: {response.status_code}")
     print(f"Response headers: {json.dumps(dict(response.headers), indent=2)}")
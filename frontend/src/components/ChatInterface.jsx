@@ -5,6 +5,31 @@ import MoodSelector from './MoodSelector';
 import ResourceLinks from './ResourceLinks';
 import CrisisAlert from './CrisisAlert';
 
+// Group resources by category into the format expected by ResourceLinks
+const formatResources = (resources) => {
+  const resourcesByCategory = {};
+  
+  resources.forEach(resource => {
+    // Extract category from resource or use a default
+    const category = resource.category || "General Resources";
+    
+    if (!resourcesByCategory[category]) {
+      resourcesByCategory[category] = [];
+    }
+    
+    resourcesByCategory[category].push({
+      name: resource.name,
+      url: resource.url,
+      phone: resource.phone
+    });
+  });
+  
+  return Object.keys(resourcesByCategory).map(category => ({
+    category,
+    links: resourcesByCategory[category]
+  }));
+};
+
 const ChatInterface = () => {
   const [messages, setMessages] = useState([
     { id: 1, text: "Hey! I'm Talk2Me, your health buddy. What's on your mind today?", sender: "bot", timestamp: new Date() }
@@ -14,6 +39,10 @@ const ChatInterface = () => {
   const [showCrisisAlert, setShowCrisisAlert] = useState(false);
   const [resources, setResources] = useState([]);
   const messagesEndRef = useRef(null);
+  // One id per chat so the backend can keep conversation history
+  const sessionIdRef = useRef(
+    window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`
+  );
   const API_URL = process.env.REACT_APP_API_URL || '';
   
   const scrollToBottom = () => {
@@ -40,81 +69,99 @@ const ChatInterface = () => {
     setInput("");
     setIsTyping(true);
     
+    const botMessageId = messages.length + 2;
+    let botMessageAdded = false;
+    
+    // Append streamed text to the bot message, creating it on the first token
+    const appendToBotMessage = (delta) => {
+      if (!botMessageAdded) {
+        botMessageAdded = true;
+        setIsTyping(false);
+        setMessages(prev => [...prev, { id: botMessageId, text: delta, sender: "bot", timestamp: new Date() }]);
+        return;
+      }
+      setMessages(prev => prev.map(message =>
+        message.id === botMessageId ? { ...message, text: message.text + delta } : message
+      ));
+    };
+    
     try {
-      // API call to backend
-      const response = await fetch(`${API_URL}/api/chat`, {
+      // Streaming API call to backend (server-sent events)
+      const response = await fetch(`${API_URL}/api/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
+          // Lets the server rate limit by session before reading the body
+          'X-Session-Id': sessionIdRef.current,
         },
-        body: JSON.stringify({ message: input }),
+        body: JSON.stringify({ message: input, session_id: sessionIdRef.current }),
       });
       
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! Status: ${response.status}`);
       }
       
-      const data = await response.json();
-      
-      // Check for crisis detection from backend
-      if (data.crisis_detected) {
-        setShowCrisisAlert(true);
-      }
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
       
-      // Update resources if provided
-      if (data.resources && data.resources.length > 0) {
-        // Process resources into categories
-        const resourcesByCategory = {};
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
         
-        data.resources.forEach(resource => {
-          // Extract category from resource or use a default
-          const category = resource.category || "General Resources";
-          
-          if (!resourcesByCategory[category]) {
-            resourcesByCategory[category] = [];
-          }
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line; keep any partial event in the buffer
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        
+        events.forEach(rawEvent => {
+          let eventName = "message";
+          let payload = "";
           
-          resourcesByCategory[category].push({
-            name: resource.name,
-            url: resource.url,
-            phone: resource.phone
+          rawEvent.split("\n").forEach(line => {
+            if (line.startsWith("event:")) eventName = line.slice(6).trim();
+            else if (line.startsWith("data:")) payload += line.slice(5).trim();
           });
+          
+          if (!payload) return;
+          const data = JSON.parse(payload);
+          
+          if (eventName === "meta") {
+            // Check for crisis detection from backend
+            if (data.crisis_detected) {
+              setShowCrisisAlert(true);
+            }
+            
+            // Update resources if provided
+            if (data.resources && data.resources.length > 0) {
+              setResources(formatResources(data.resources));
+            }
+          } else if (eventName === "token") {
+            appendToBotMessage(data.delta);
+          }
         });
-        
-        // Convert to format expected by ResourceLinks
-        const formattedResources = Object.keys(resourcesByCategory).map(category => ({
-          category,
-          links: resourcesByCategory[category]
-        }));
-        
-        setResources(formattedResources);
       }
       
-      // Add bot response with typing effect delay
-      setTimeout(() => {
-        const botMessage = {
-          id: messages.length + 2,
-          text: data.message,
-          sender: "bot",
-          timestamp: new Date()
-        };
-        setMessages(prev => [...prev, botMessage]);
-        setIsTyping(false);
-      }, 1000);
+      if (!botMessageAdded) {
+        throw new Error("Stream ended without a response");
+      }
       
     } catch (error) {
       console.error('Error:', error);
       // Error handling
-      setTimeout(() => {
+      if (!botMessageAdded) {
         const errorMessage = {
-          id: messages.length + 2,
+          id: botMessageId,
           text: "Sorry, I'm having trouble connecting right now. Please try again later.",
           sender: "bot",
           timestamp: new Date()
         };
         setMessages(prev => [...prev, errorMessage]);
-        setIsTyping(false);
-      }, 1000);
+      }
+    } finally {
+      setIsTyping(false);
     }
   };
   